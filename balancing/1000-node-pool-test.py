@@ -0,0 +1,138 @@
+from hamcrest import *
+
+import cloudant
+
+
+class Clock(object):
+    # Stands in for the time module so ejections expire on demand
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.now += secs
+
+
+def with_clock(func):
+    def wrapper():
+        orig = cloudant.time
+        cloudant.time = Clock()
+        try:
+            func(cloudant.time)
+        finally:
+            cloudant.time = orig
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def pool(**kwargs):
+    kwargs.setdefault("eject_time", 1.0)
+    kwargs.setdefault("max_eject_time", 10.0)
+    return cloudant.NodePool(["a", "b", "c"], **kwargs)
+
+
+def node(p, netloc):
+    return [n for n in p.nodes if n.netloc == netloc][0]
+
+
+def fail(p, n, times):
+    for i in range(times):
+        n.outstanding += 1
+        p.release(n, failed=True)
+
+
+def send(p, n, latency):
+    # A request that was routed to `n` whatever its score
+    p._take(n)
+    p.release(n, latency=latency)
+
+
+def picks(p, count, latency=0.01):
+    ret = []
+    for i in range(count):
+        n = p.acquire()
+        ret.append(n.netloc)
+        p.release(n, latency=latency)
+    return ret
+
+
+@with_clock
+def test_repeated_failures_eject(clock):
+    p = pool(max_failures=3)
+    a = node(p, "a")
+    fail(p, a, 2)
+    assert_that(a.probation, equal_to(False))
+    fail(p, a, 1)
+    assert_that(a.probation, equal_to(True))
+    assert_that(a.ejected_until, equal_to(clock.now + 1.0))
+    assert_that(picks(p, 20), is_not(has_item("a")))
+
+
+@with_clock
+def test_single_probe_after_ejection(clock):
+    p = pool()
+    a = node(p, "a")
+    fail(p, a, 3)
+    clock.sleep(1.0)
+    probe = p.acquire()
+    assert_that(probe, is_(a))
+    assert_that(a.probing, equal_to(True))
+    # Nothing else goes to it while the probe is out
+    assert_that(picks(p, 20), is_not(has_item("a")))
+    p.release(probe, latency=0.01)
+    assert_that(a.probation, equal_to(False))
+    assert_that(a.latency, equal_to(0.01))
+    assert_that(picks(p, 30), has_item("a"))
+
+
+@with_clock
+def test_failed_probe_backs_off(clock):
+    p = pool(eject_time=1.0, max_eject_time=5.0)
+    a = node(p, "a")
+    fail(p, a, 3)
+    for backoff in (2.0, 4.0, 5.0, 5.0):
+        clock.sleep(a.ejected_until - clock.now)
+        probe = p.acquire()
+        assert_that(probe, is_(a))
+        p.release(probe, failed=True)
+        assert_that(a.ejected_until - clock.now, equal_to(backoff))
+        assert_that(picks(p, 10), is_not(has_item("a")))
+
+
+@with_clock
+def test_slow_node_is_ejected(clock):
+    p = pool(slow_factor=5.0, min_samples=5)
+    for netloc in ("b", "c"):
+        send(p, node(p, netloc), 0.01)
+    a = node(p, "a")
+    for i in range(4):
+        send(p, a, 1.0)
+        assert_that(a.probation, equal_to(False))
+    send(p, a, 1.0)
+    assert_that(a.probation, equal_to(True))
+    assert_that(a.ejections, equal_to(1))
+    assert_that(node(p, "b").probation, equal_to(False))
+
+
+@with_clock
+def test_slow_is_relative_to_the_median(clock):
+    p = pool(slow_factor=5.0, min_samples=1)
+    for netloc, latency in (("b", 0.1), ("c", 0.3)):
+        send(p, node(p, netloc), latency)
+    a = node(p, "a")
+    send(p, a, 1.4)
+    assert_that(a.probation, equal_to(False))
+    send(p, a, 10.0)
+    assert_that(a.probation, equal_to(True))
+
+
+@with_clock
+def test_all_ejected_uses_first_due_back(clock):
+    p = pool()
+    for netloc, times in (("a", 1), ("b", 0), ("c", 2)):
+        n = node(p, netloc)
+        n.ejections = times
+        fail(p, n, 3)
+    assert_that(p.acquire().netloc, equal_to("b"))
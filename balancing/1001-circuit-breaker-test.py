@@ -0,0 +1,123 @@
+import itertools
+
+from hamcrest import *
+
+import cloudant
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.now += secs
+
+
+def with_clock(func):
+    def wrapper():
+        orig = cloudant.time
+        cloudant.time = Clock()
+        try:
+            func(cloudant.time)
+        finally:
+            cloudant.time = orig
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def tripped():
+    b = cloudant.CircuitBreaker(threshold=2, reset_timeout=5.0)
+    b.failure()
+    b.failure()
+    return b
+
+
+class Response(object):
+    def __init__(self, retry_after=None):
+        self.headers = {}
+        if retry_after is not None:
+            self.headers["Retry-After"] = retry_after
+
+
+@with_clock
+def test_opens_at_threshold(clock):
+    b = cloudant.CircuitBreaker(threshold=3)
+    b.failure()
+    b.failure()
+    assert_that(b.allow(), equal_to(True))
+    b.success()
+    b.failure()
+    b.failure()
+    assert_that(b.state, equal_to(b.CLOSED))
+    b.failure()
+    assert_that(b.state, equal_to(b.OPEN))
+    assert_that(b.allow(), equal_to(False))
+
+
+@with_clock
+def test_half_open_allows_one_probe(clock):
+    b = tripped()
+    clock.sleep(4.9)
+    assert_that(b.allow(), equal_to(False))
+    clock.sleep(0.1)
+    assert_that(b.allow(), equal_to(True))
+    assert_that(b.state, equal_to(b.HALF_OPEN))
+    assert_that(b.allow(), equal_to(False))
+    b.success()
+    assert_that(b.state, equal_to(b.CLOSED))
+    assert_that(b.allow(), equal_to(True))
+
+
+@with_clock
+def test_failed_probe_reopens(clock):
+    b = tripped()
+    clock.sleep(5.0)
+    assert_that(b.allow(), equal_to(True))
+    b.failure()
+    assert_that(b.state, equal_to(b.OPEN))
+    assert_that(b.allow(), equal_to(False))
+    clock.sleep(5.0)
+    assert_that(b.allow(), equal_to(True))
+
+
+@with_clock
+def test_released_probe_frees_the_slot(clock):
+    # A probe that ends in neither success nor failure, say a 404,
+    # must not leave the breaker half open with no probe allowed
+    b = tripped()
+    clock.sleep(5.0)
+    assert_that(b.allow(), equal_to(True))
+    assert_that(b.allow(), equal_to(False))
+    b.release()
+    assert_that(b.state, equal_to(b.HALF_OPEN))
+    assert_that(b.allow(), equal_to(True))
+
+
+def test_retry_methods_and_paths():
+    p = cloudant.RetryPolicy(max_retries=2)
+    assert_that(p.can_retry("get", "db/doc", {}, 0), equal_to(True))
+    assert_that(p.can_retry("post", "db/_find", {}, 0), equal_to(False))
+    assert_that(p.can_retry("post", "db/_bulk_docs/", {}, 0),
+            equal_to(True))
+    assert_that(p.can_retry("get", "db/doc", {}, 2), equal_to(False))
+
+
+def test_retry_needs_replayable_body():
+    p = cloudant.RetryPolicy()
+    body = {"data": (c for c in "abc")}
+    assert_that(p.can_retry("put", "db/doc", body, 0), equal_to(False))
+    assert_that(p.can_retry("put", "db/doc", {"data": "abc"}, 0),
+            equal_to(True))
+
+
+def test_retry_delay():
+    p = cloudant.RetryPolicy(backoff=0.1, max_backoff=1.0)
+    for attempt, _ in itertools.product(range(6), range(50)):
+        cap = min(1.0, 0.1 * 2 ** attempt)
+        assert_that(p.delay(attempt), less_than_or_equal_to(cap))
+    assert_that(p.delay(0, Response("0.5")), equal_to(0.5))
+    assert_that(p.delay(0, Response("30")), equal_to(1.0))
+    assert_that(p.delay(0, Response("soon")), less_than_or_equal_to(0.1))
@@ -0,0 +1,123 @@
+from hamcrest import *
+
+import cloudant
+
+
+# The since sequences used by streaming/1003-changes-test.py and
+# changes/1001-maintenance-mode-test.py. All of these are q=4 except
+# BAD_SINCE which is q=8 with one range on a node that doesn't exist.
+
+BAD_SINCE = "".join("""
+    972-g1AAAAFMeJzLYWBg4MhgTmHgz8tPSTV0MDQy1zMAQsMc
+    oARTIkOS_P___7MSq3EqyWMBkgwPgNR_sMoaAioPQFTez0ps
+    gKs0xqpyAUTl_qzEHAJmNkBUzs9KrMWpMikBSCbVg93YgFuV
+    A0hVPFhVGUiVRF5-SVFqYk5OZSJIPbpyBZBye4jyLAARYF5X
+""".split())
+
+# All nodes are node1 with an update_seq of 0
+SINCE_SEQ_1 = "".join("""\
+    0-g1AAAACjeJzLYWBgYMlgTmHgz8tPSTV0M
+    DQy1zMAQsMcoARTIkOS_f___7MSGXAqyWMB
+    kgwHgNR_olQ2QFTux6cyyQFIJtVDzMsCAEo
+    dK6Y
+""".split())
+
+# All nodes are node3 with update_seq of 400
+SINCE_SEQ_2 = "".join("""
+    2000-g1AAAACveJzLYWBgYMlgTmHgz8tPST
+    V2MDQy1zMAQsMcoARTIkOS_f___7OSGBgYv
+    -BUlccCJBkOAKn_xCpugCjeT0BxkgOQTKqH
+    m5oFAJG7L4Y
+""".split())
+
+Q4 = [(0x00000000, 0x3fffffff), (0x40000000, 0x7fffffff),
+        (0x80000000, 0xbfffffff), (0xc0000000, 0xffffffff)]
+
+
+def test_decode_bad_since():
+    shards = cloudant.decode_seq(BAD_SINCE)
+    assert_that(shards, has_length(8))
+    assert_that(sum(s.seq for s in shards), equal_to(972))
+    nodes = set(s.node for s in shards)
+    assert_that(nodes, has_item("notreallyanode@127.0.0.1"))
+    assert_that(shards, only_contains(has_property("epoch", None)))
+
+
+def test_decode_since_seqs():
+    for seq, node, value in ((SINCE_SEQ_1, "node1@127.0.0.1", 0),
+            (SINCE_SEQ_2, "node3@127.0.0.1", 500)):
+        shards = cloudant.decode_seq(seq)
+        assert_that(sorted(s.range for s in shards), equal_to(Q4))
+        assert_that(shards, only_contains(has_properties(
+            "node", node,
+            "seq", value
+        )))
+
+
+def test_round_trip():
+    for seq in (BAD_SINCE, SINCE_SEQ_1, SINCE_SEQ_2):
+        assert_that(cloudant.encode_seq(cloudant.decode_seq(seq)),
+                equal_to(seq))
+
+
+def test_round_trip_epochs():
+    shards = [
+        cloudant.ShardSeq("node1@127.0.0.1", r, 2 ** 40 + i,
+                ("node1@127.0.0.1", i))
+        for i, r in enumerate(Q4)
+    ]
+    seq = cloudant.encode_seq(shards)
+    assert_that(cloudant.decode_seq(seq), equal_to(shards))
+    assert_that(seq, starts_with("%d-" % sum(s.seq for s in shards)))
+
+
+def test_decode_rejects_plain_seqs():
+    for seq in ("12", 12, None):
+        assert_that(calling(cloudant.decode_seq).with_args(seq),
+                raises(ValueError))
+
+
+def test_max_seq():
+    merged = cloudant.decode_seq(cloudant.max_seq(SINCE_SEQ_1, SINCE_SEQ_2))
+    assert_that([s.range for s in merged], equal_to(Q4))
+    assert_that(merged, only_contains(has_properties(
+        "node", "node3@127.0.0.1",
+        "seq", 500
+    )))
+
+
+def test_max_seq_per_range():
+    ones = cloudant.decode_seq(SINCE_SEQ_1)
+    threes = cloudant.decode_seq(SINCE_SEQ_2)
+    ahead = [s._replace(seq=900) for s in ones[:2]]
+    merged = cloudant.decode_seq(cloudant.max_seq(ahead, threes))
+    by_range = dict((s.range, s) for s in merged)
+    for s in ahead:
+        assert_that(by_range[s.range].seq, equal_to(900))
+    assert_that(sum(s.seq for s in merged), equal_to(2 * 900 + 2 * 500))
+
+
+def test_max_seq_partial():
+    ones = cloudant.decode_seq(SINCE_SEQ_1)
+    merged = cloudant.decode_seq(cloudant.max_seq(ones[:1], ones[1:]))
+    assert_that(sorted(merged), equal_to(sorted(ones)))
+
+
+def test_max_seq_rejects_different_q():
+    assert_that(calling(cloudant.max_seq).with_args(BAD_SINCE, SINCE_SEQ_2),
+            raises(ValueError))
+
+
+def test_pending_changes():
+    update_seqs = dict((r, "600-x") for r in Q4)
+    assert_that(cloudant.pending_changes(SINCE_SEQ_2, update_seqs),
+            equal_to(4 * 100))
+    # A copy on the recorded node takes precedence over the range
+    update_seqs[("node3@127.0.0.1", Q4[0])] = 450
+    assert_that(cloudant.pending_changes(SINCE_SEQ_2, update_seqs),
+            equal_to(3 * 100))
+    assert_that(cloudant.pending_changes(SINCE_SEQ_2, {}), equal_to(0))
+
+
+def test_parse_range():
+    assert_that(cloudant.parse_range("40000000-7fffffff"), equal_to(Q4[1]))
@@ -1,21 +1,34 @@
 
+import array
 import base64
+import collections
 import contextlib as ctx
+import email.utils
+import functools
 import hashlib
+import httplib
+import itertools
 import json
 import logging
 import os
+import Queue
 import random
 import re
+import socket
 import struct
+import threading
 import time
+import types
 import urllib
 import urlparse
+import weakref
+import zlib
 import StringIO
 import gzip as gziplib
 
 
 import requests
+from concurrent import futures
 from hamcrest.core.base_matcher import BaseMatcher
 
 
@@ -47,10 +60,315 @@ def gzip(string):
     return out.getvalue()
 
 
+class JSONCodec(object):
+    def __init__(self, name, dumps, loads, iterencode=None, raw_decode=None):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+        self.iterencode = iterencode or (lambda obj: iter((dumps(obj),)))
+        # raw_decode(buf, idx) -> (value, end) lets the stream parser
+        # decode values in place without slicing them out first.
+        self.raw_decode = raw_decode
+
+
+def _orjson_codec():
+    import orjson
+    return JSONCodec("orjson", orjson.dumps, orjson.loads)
+
+
+def _ujson_codec():
+    import ujson
+    # ujson raises on integers that don't fit in 64 bits where the
+    # stdlib switches to longs, so hand those documents over to it.
+    stdlib = _stdlib_codec()
+    def dumps(obj):
+        try:
+            return ujson.dumps(obj, escape_forward_slashes=False)
+        except OverflowError:
+            return stdlib.dumps(obj)
+    def loads(data):
+        try:
+            return ujson.loads(data)
+        except (OverflowError, ValueError):
+            return stdlib.loads(data)
+    return JSONCodec("ujson", dumps, loads)
+
+
+def _simplejson_codec():
+    import simplejson
+    enc = simplejson.JSONEncoder(separators=(",", ":"))
+    dec = simplejson.JSONDecoder()
+    return JSONCodec("simplejson", enc.encode, simplejson.loads,
+            enc.iterencode, dec.raw_decode)
+
+
+def _stdlib_codec():
+    enc = json.JSONEncoder(separators=(",", ":"))
+    dec = json.JSONDecoder()
+    return JSONCodec("json", enc.encode, json.loads, enc.iterencode,
+            dec.raw_decode)
+
+
+JSON_CODECS = [
+    ("orjson", _orjson_codec),
+    ("ujson", _ujson_codec),
+    ("simplejson", _simplejson_codec),
+    ("json", _stdlib_codec)
+]
+
+
+def load_json_codec(name=None):
+    # With no name pick the fastest backend that imports
+    for codec_name, loader in JSON_CODECS:
+        if name is not None and name != codec_name:
+            continue
+        try:
+            return loader()
+        except ImportError:
+            if name is not None:
+                raise
+    raise ValueError("Unknown JSON codec: %s" % name)
+
+
+def set_json_codec(name=None):
+    global JSON
+    JSON = load_json_codec(name)
+    return JSON
+
+
+def json_dumps(obj):
+    return JSON.dumps(obj)
+
+
+def json_loads(data):
+    return JSON.loads(data)
+
+
+class GzipBody(object):
+    """\
+    A request body that gzips its source as it is sent. The source is
+    a callable returning an iterable of strings so that the body can be
+    replayed on retries without ever holding the whole payload. A
+    source that can't restart is marked not `replayable` and is sent
+    once only.
+    """
+
+    def __init__(self, source, level=6, stats=None, replayable=True):
+        self.source = source
+        self.replayable = replayable
+        self.level = level
+        self.stats = stats
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def __iter__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        z = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in _coalesce(self.source()):
+            start = time.time()
+            out = z.compress(chunk)
+            self.seconds += time.time() - start
+            self.bytes_in += len(chunk)
+            if out:
+                self.bytes_out += len(out)
+                yield out
+        start = time.time()
+        out = z.flush()
+        self.seconds += time.time() - start
+        self.bytes_out += len(out)
+        yield out
+        if self.stats is not None:
+            self.stats.incr("gzip_requests")
+            self.stats.incr("gzip_bytes_in", self.bytes_in)
+            self.stats.incr("gzip_bytes_out", self.bytes_out)
+            self.stats.incr("gzip_seconds", self.seconds)
+
+    def report(self):
+        return {
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "seconds": self.seconds
+        }
+
+
+def encode_body(source, threshold=None, level=6, stats=None,
+        replayable=True):
+    # Returns the plain body as a string if the source stays under the
+    # threshold, otherwise a GzipBody that will restart the source. One
+    # that can't restart carries on from the prefix read so far.
+    if threshold is None:
+        return "".join(source())
+    size = 0
+    prefix = []
+    chunks = iter(source())
+    for chunk in chunks:
+        prefix.append(chunk)
+        size += len(chunk)
+        if size > threshold:
+            if not replayable:
+                source = lambda: itertools.chain(prefix, chunks)
+            return GzipBody(source, level=level, stats=stats,
+                    replayable=replayable)
+    return "".join(prefix)
+
+
+def _coalesce(chunks, size=65536):
+    buf = []
+    buflen = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        buflen += len(chunk)
+        if buflen >= size:
+            yield "".join(buf)
+            buf = []
+            buflen = 0
+    if buf:
+        yield "".join(buf)
+
+
+def _iter_json(obj):
+    return JSON.iterencode(obj)
+
+
+def _iter_bulk_docs(docs):
+    return _iter_bulk_body(json_dumps(doc) for doc in docs)
+
+
+def _iter_bulk_body(encoded_docs):
+    yield '{"docs":['
+    for i, doc in enumerate(encoded_docs):
+        if i > 0:
+            yield ","
+        yield doc
+    yield "]}"
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _imap_ordered(func, items, concurrency):
+    # Like map() over a thread pool but with a bounded number of calls
+    # in flight and results returned in input order as they complete.
+    executor = futures.ThreadPoolExecutor(max_workers=concurrency)
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= concurrency:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for f in pending:
+            f.cancel()
+        executor.shutdown(wait=False)
+
+
+def _interleave(funcs, maxsize=1024, bind=None):
+    # Run each iterable returned by funcs on its own thread and yield
+    # items from all of them as they arrive. The iterables are consumed
+    # on those threads too so bind wraps the whole run, not just func.
+    queue = Queue.Queue(maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _run(func):
+        try:
+            for item in func():
+                if not _put((None, item)):
+                    return
+        except Exception as e:
+            _put((e, None))
+        _put((done, None))
+
+    run = _run if bind is None else bind(_run)
+    executor = futures.ThreadPoolExecutor(max_workers=max(len(funcs), 1))
+    try:
+        for func in funcs:
+            executor.submit(run, func)
+        remaining = len(funcs)
+        while remaining:
+            error, item = queue.get()
+            if error is done:
+                remaining -= 1
+            elif error is not None:
+                raise error
+            else:
+                yield item
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
+
+
+def _data_source(data, size=65536):
+    # A send_body source for a string or file and whether it restarts.
+    # Files restart from wherever they were positioned when handed in.
+    if not hasattr(data, "read"):
+        return lambda: _iter_data(data, size), True
+    try:
+        start = data.tell()
+        data.seek(start)
+    except (AttributeError, IOError, OSError):
+        return lambda: _iter_data(data, size), False
+    def source():
+        data.seek(start)
+        return _iter_data(data, size)
+    return source, True
+
+
+def _iter_data(data, size=65536):
+    if hasattr(data, "read"):
+        while True:
+            chunk = data.read(size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for i in xrange(0, len(data), size):
+            yield data[i:i+size]
+
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml"
+)
+
+
 def quote(str):
     return urllib.quote(str, safe="")
 
 
+def _seq_number(seq):
+    # Clustered sequences are "<sum of shard seqs>-<opaque>"
+    if isinstance(seq, basestring):
+        return int(seq.split("-", 1)[0])
+    return seq or 0
+
+
 def parse_shard_name(name):
     match = DBNAME_RE.match(name)
     if not match:
@@ -58,6 +376,281 @@ def parse_shard_name(name):
     return match.group(1)
 
 
+# Since sequences
+#
+# Clustered sequences are "<sum>-<base64url(term_to_binary(Seqs))>"
+# where Seqs is a list of {Node, [Begin, End], Seq} tuples, one per
+# shard range. Seq is an integer or {Seq, Uuid, EpochNode} on servers
+# that track epochs. Only the subset of the external term format that
+# appears in these terms (plus floats and maps) is supported.
+
+class Atom(str):
+    def __repr__(self):
+        return "Atom(%s)" % str.__repr__(self)
+
+
+ShardSeq = collections.namedtuple("ShardSeq", ["node", "range", "seq",
+        "epoch"])
+
+
+ETF_VERSION = 131
+ETF_COMPRESSED = 80
+
+
+def etf_decode(data):
+    if ord(data[0]) != ETF_VERSION:
+        raise ValueError("Invalid external term format version")
+    if ord(data[1]) == ETF_COMPRESSED:
+        size = struct.unpack(">I", data[2:6])[0]
+        data = zlib.decompress(data[6:])
+        if len(data) != size:
+            raise ValueError("Invalid compressed term size")
+        pos = 0
+    else:
+        pos = 1
+    term, pos = _etf_decode(data, pos)
+    if pos != len(data):
+        raise ValueError("Trailing data after term")
+    return term
+
+
+def _etf_decode(data, pos):
+    tag = ord(data[pos])
+    pos += 1
+    if tag == 97:
+        return ord(data[pos]), pos + 1
+    if tag == 98:
+        return struct.unpack(">i", data[pos:pos+4])[0], pos + 4
+    if tag in (110, 111):
+        if tag == 110:
+            n, pos = ord(data[pos]), pos + 1
+        else:
+            n, pos = struct.unpack(">I", data[pos:pos+4])[0], pos + 4
+        sign = ord(data[pos])
+        value = 0
+        for i, c in enumerate(data[pos+1:pos+1+n]):
+            value |= ord(c) << (8 * i)
+        return -value if sign else value, pos + 1 + n
+    if tag in (100, 118):
+        n = struct.unpack(">H", data[pos:pos+2])[0]
+        return Atom(data[pos+2:pos+2+n]), pos + 2 + n
+    if tag in (115, 119):
+        n = ord(data[pos])
+        return Atom(data[pos+1:pos+1+n]), pos + 1 + n
+    if tag in (104, 105):
+        if tag == 104:
+            n, pos = ord(data[pos]), pos + 1
+        else:
+            n, pos = struct.unpack(">I", data[pos:pos+4])[0], pos + 4
+        items = []
+        for i in xrange(n):
+            item, pos = _etf_decode(data, pos)
+            items.append(item)
+        return tuple(items), pos
+    if tag == 106:
+        return [], pos
+    if tag == 107:
+        n = struct.unpack(">H", data[pos:pos+2])[0]
+        return [ord(c) for c in data[pos+2:pos+2+n]], pos + 2 + n
+    if tag == 108:
+        n = struct.unpack(">I", data[pos:pos+4])[0]
+        pos += 4
+        items = []
+        for i in xrange(n):
+            item, pos = _etf_decode(data, pos)
+            items.append(item)
+        tail, pos = _etf_decode(data, pos)
+        if tail != []:
+            raise ValueError("Improper lists are not supported")
+        return items, pos
+    if tag == 109:
+        n = struct.unpack(">I", data[pos:pos+4])[0]
+        return data[pos+4:pos+4+n], pos + 4 + n
+    if tag == 70:
+        return struct.unpack(">d", data[pos:pos+8])[0], pos + 8
+    if tag == 116:
+        n = struct.unpack(">I", data[pos:pos+4])[0]
+        pos += 4
+        ret = {}
+        for i in xrange(n):
+            key, pos = _etf_decode(data, pos)
+            ret[key], pos = _etf_decode(data, pos)
+        return ret, pos
+    raise ValueError("Unsupported external term tag: %d" % tag)
+
+
+def etf_encode(term, compressed=True):
+    # Like term_to_binary(Term, [compressed]) which keeps the plain
+    # encoding when compressing would not make it smaller
+    data = "".join(_etf_encode(term))
+    if compressed:
+        packed = zlib.compress(data, 6)
+        if len(packed) + 4 < len(data):
+            size = struct.pack(">I", len(data))
+            return chr(ETF_VERSION) + chr(ETF_COMPRESSED) + size + packed
+    return chr(ETF_VERSION) + data
+
+
+def _etf_encode(term):
+    if isinstance(term, _Encoded):
+        yield term
+    elif isinstance(term, bool):
+        yield _etf_atom("true" if term else "false")
+    elif isinstance(term, Atom):
+        yield _etf_atom(term)
+    elif isinstance(term, (int, long)):
+        yield _etf_int(term)
+    elif isinstance(term, float):
+        yield chr(70) + struct.pack(">d", term)
+    elif isinstance(term, tuple):
+        if len(term) < 256:
+            yield chr(104) + chr(len(term))
+        else:
+            yield chr(105) + struct.pack(">I", len(term))
+        for item in term:
+            for chunk in _etf_encode(item):
+                yield chunk
+    elif isinstance(term, list):
+        if not term:
+            yield chr(106)
+        elif len(term) < 65536 and all(type(i) in (int, long)
+                and 0 <= i < 256 for i in term):
+            yield chr(107) + struct.pack(">H", len(term))
+            yield "".join(chr(i) for i in term)
+        else:
+            yield chr(108) + struct.pack(">I", len(term))
+            for item in term:
+                for chunk in _etf_encode(item):
+                    yield chunk
+            yield chr(106)
+    elif isinstance(term, basestring):
+        if isinstance(term, unicode):
+            term = term.encode("utf-8")
+        yield chr(109) + struct.pack(">I", len(term)) + term
+    elif isinstance(term, dict):
+        yield chr(116) + struct.pack(">I", len(term))
+        for key, value in term.items():
+            for chunk in _etf_encode(key):
+                yield chunk
+            for chunk in _etf_encode(value):
+                yield chunk
+    else:
+        raise TypeError("Can't encode %r as an Erlang term" % (term,))
+
+
+def _etf_int(value):
+    if 0 <= value < 256:
+        return chr(97) + chr(value)
+    if -2 ** 31 <= value < 2 ** 31:
+        return chr(98) + struct.pack(">i", value)
+    digits = []
+    n = abs(value)
+    while n:
+        digits.append(chr(n & 0xFF))
+        n >>= 8
+    if len(digits) < 256:
+        head = chr(110) + chr(len(digits))
+    else:
+        head = chr(111) + struct.pack(">I", len(digits))
+    return head + chr(1 if value < 0 else 0) + "".join(digits)
+
+
+def _etf_atom(name):
+    if len(name) < 256:
+        return chr(100) + struct.pack(">H", len(name)) + name
+    raise ValueError("Atom too long: %r" % name)
+
+
+def decode_seq(seq):
+    if not isinstance(seq, basestring) or "-" not in seq:
+        raise ValueError("Not a clustered sequence: %r" % (seq,))
+    opaque = str(seq.split("-", 1)[1])
+    data = base64.urlsafe_b64decode(opaque + "=" * (-len(opaque) % 4))
+    ret = []
+    for node, (begin, end), value in etf_decode(data):
+        epoch = None
+        if isinstance(value, tuple):
+            value, epoch = value[0], value[1:]
+        ret.append(ShardSeq(str(node), (begin, end), value, epoch))
+    return ret
+
+
+def encode_seq(shards):
+    # Only the seq changes between calls for a feed so the encoded
+    # {Node, Range, _} head of each entry is cached.
+    parts = [chr(108), struct.pack(">I", len(shards))]
+    for shard in shards:
+        value = shard.seq
+        if shard.epoch is not None:
+            value = (value,) + tuple(shard.epoch)
+        head = _SEQ_HEADS.get((shard.node, shard.range))
+        if head is None:
+            if len(_SEQ_HEADS) > 10000:
+                _SEQ_HEADS.clear()
+            head = chr(104) + chr(3) + _etf_atom(shard.node) + \
+                    "".join(_etf_encode(list(shard.range)))
+            _SEQ_HEADS[(shard.node, shard.range)] = head
+        parts.append(head)
+        if type(value) in (int, long):
+            parts.append(_etf_int(value))
+        else:
+            parts.extend(_etf_encode(value))
+    parts.append(chr(106))
+    data = etf_encode(_Encoded("".join(parts)))
+    opaque = base64.urlsafe_b64encode(data).rstrip("=")
+    return "%d-%s" % (sum(s.seq for s in shards), opaque)
+
+
+_SEQ_HEADS = {}
+
+
+class _Encoded(str):
+    pass
+
+
+def max_seq(seq1, seq2):
+    # Highest seq per range. Ranges only present in one input are kept
+    # but ranges that overlap come from databases with a different q
+    # and have no meaningful merge.
+    shards = collections.OrderedDict()
+    for shard in _shard_seqs(seq1) + _shard_seqs(seq2):
+        current = shards.get(shard.range)
+        if current is None or shard.seq > current.seq:
+            shards[shard.range] = shard
+    ranges = sorted(shards)
+    for prev, cur in zip(ranges, ranges[1:]):
+        if cur[0] <= prev[1]:
+            raise ValueError("Sequences have overlapping shard ranges")
+    return encode_seq([shards[r] for r in ranges])
+
+
+def pending_changes(seq, update_seqs):
+    # Approximate changes left to read from `seq` given the current
+    # update_seq of each shard keyed by range or by (node, range).
+    # Seqs recorded on another node than the current copy can only
+    # be compared loosely so this is an estimate.
+    total = 0
+    for shard in _shard_seqs(seq):
+        current = update_seqs.get((shard.node, shard.range))
+        if current is None:
+            current = update_seqs.get(shard.range)
+        if current is None:
+            continue
+        total += max(_seq_number(current) - shard.seq, 0)
+    return total
+
+
+def parse_range(name):
+    begin, end = name.split("-")
+    return (int(begin, 16), int(end, 16))
+
+
+def _shard_seqs(seq):
+    if isinstance(seq, basestring):
+        return decode_seq(seq)
+    return list(seq)
+
+
 class EnvironmentConfig(object):
 
     DEFAULTS = {
@@ -94,7 +687,9 @@ class EnvironmentConfig(object):
         "TESTY_SAVE_USER": None,
         "TESTY_SAVE_PASS": None,
         "TESTY_RESULT_DIR": None,
-        "TESTY_TIMESTART": None
+        "TESTY_TIMESTART": None,
+        "TESTY_GZIP_THRESHOLD": None,
+        "TESTY_JSON_CODEC": None
     }
 
     def __init__(self):
@@ -161,12 +756,159 @@ class EnvironmentConfig(object):
 
 
 CONFIG = EnvironmentConfig()
+JSON = load_json_codec(CONFIG.json_codec)
+
+
+class Counters(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def incr(self, name, count=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    def get(self, name):
+        with self.lock:
+            return self.counts.get(name, 0)
+
+    def snapshot(self):
+        with self.lock:
+            return self.counts.copy()
+
+
+class CircuitOpenError(requests.ConnectionError):
+    pass
+
+
+class CircuitBreaker(object):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold=5, reset_timeout=10.0, stats=None):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.stats = stats or Counters()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.time() - self.opened_at < self.reset_timeout:
+                    return False
+                self._transition(self.HALF_OPEN)
+            # Only one probe at a time while half open
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def release(self):
+        with self.lock:
+            self.probing = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN:
+                self._transition(self.OPEN)
+            elif self.state == self.CLOSED and self.failures >= self.threshold:
+                self._transition(self.OPEN)
+
+    def _transition(self, state):
+        self.state = state
+        if state == self.OPEN:
+            self.opened_at = time.time()
+        self.stats.incr("breaker_" + state)
+
+
+class RetryPolicy(object):
+    METHODS = ("head", "get", "put", "delete", "options")
+    PATHS = ("_bulk_docs",)
+    STATUSES = (429, 500, 502, 503, 504)
+    ERRORS = (requests.ConnectionError, requests.Timeout)
+
+    def __init__(self, max_retries=5, backoff=0.1, max_backoff=10.0,
+            methods=METHODS, paths=PATHS, statuses=STATUSES,
+            breaker_threshold=5, breaker_timeout=10.0):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.methods = methods
+        self.paths = paths
+        self.statuses = statuses
+        self.breaker_threshold = breaker_threshold
+        self.breaker_timeout = breaker_timeout
+
+    def can_retry(self, method, path, kwargs, attempt):
+        if attempt >= self.max_retries:
+            return False
+        if not _replayable(kwargs.get("data")):
+            return False
+        if method in self.methods:
+            return True
+        return path.rstrip("/").split("/")[-1] in self.paths
+
+    def delay(self, attempt, resp=None):
+        if resp is not None:
+            after = _retry_after(resp.headers.get("Retry-After"))
+            if after is not None:
+                return min(after, self.max_backoff)
+        # Full jitter keeps a herd of clients from retrying in lockstep
+        cap = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return random.uniform(0, cap)
+
+    def breaker(self, stats):
+        if self.breaker_threshold is None:
+            return None
+        return CircuitBreaker(self.breaker_threshold, self.breaker_timeout,
+                stats=stats)
+
+
+def _replayable(data):
+    # Generators and file objects can only be sent once and neither can
+    # a gzipped body whose source can't restart
+    if not getattr(data, "replayable", True):
+        return False
+    return not (hasattr(data, "next") or hasattr(data, "read"))
+
+
+def _retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(parsed) - time.time())
 
 
 class Resource(object):
-    def __init__(self, scheme, netloc, auth=None, session=None):
+    def __init__(self, scheme, netloc, auth=None, session=None, retry=None):
         self.scheme = scheme
         self.netloc = netloc
+        self.retry = retry
+        self.stats = Counters()
+        self.breakers = {}
+        self.breakers_lock = threading.Lock()
         if session is None:
             session = requests.session()
             adapter = requests.adapters.HTTPAdapter(pool_maxsize=256)
@@ -177,7 +919,26 @@ class Resource(object):
         self.s.headers.update({
             "Content-Type": "application/json"
         })
-        self.check_status_code = True
+        # Everything that changes from call to call is kept per thread
+        # so a single Resource and its connection pool can be shared.
+        self._local = threading.local()
+        self.raise_errors = True
+
+    @property
+    def last_req(self):
+        return getattr(self._local, "last_req", None)
+
+    @last_req.setter
+    def last_req(self, resp):
+        self._local.last_req = resp
+
+    @property
+    def check_status_code(self):
+        return getattr(self._local, "check_status_code", self.raise_errors)
+
+    @check_status_code.setter
+    def check_status_code(self, value):
+        self._local.check_status_code = value
 
     @ctx.contextmanager
     def return_errors(self):
@@ -188,6 +949,47 @@ class Resource(object):
         finally:
             self.check_status_code = original
 
+    @ctx.contextmanager
+    def user_context(self, auth, headers=None):
+        orig_auth = getattr(self._local, "auth", None)
+        orig_headers = getattr(self._local, "headers", None)
+        self._local.auth = auth
+        self._local.headers = dict(orig_headers or {}, **(headers or {}))
+        try:
+            yield self
+        finally:
+            self._local.auth = orig_auth
+            self._local.headers = orig_headers
+
+    def in_context(self):
+        # Whether this thread has a user context or error policy of its
+        # own in effect, which work shared with other threads would lose
+        if getattr(self._local, "auth", None) is not None:
+            return True
+        if getattr(self._local, "headers", None):
+            return True
+        return self.check_status_code != self.raise_errors
+
+    def bind(self, func):
+        # User contexts and error policy are per thread. Capture the
+        # caller's so work handed off to a pool still runs under them.
+        auth = getattr(self._local, "auth", None)
+        headers = getattr(self._local, "headers", None)
+        check_status = self.check_status_code
+        def _run(*args, **kwargs):
+            local = self._local
+            orig_auth = getattr(local, "auth", None)
+            orig_headers = getattr(local, "headers", None)
+            orig_check = self.check_status_code
+            local.auth, local.headers = auth, headers
+            self.check_status_code = check_status
+            try:
+                return func(*args, **kwargs)
+            finally:
+                local.auth, local.headers = orig_auth, orig_headers
+                self.check_status_code = orig_check
+        return _run
+
     def head(self, path, **kwargs):
         return self._req("head", path, kwargs)
 
@@ -207,35 +1009,297 @@ class Resource(object):
         return self._req("options", path, kwargs)
 
     def _req(self, method, path, kwargs):
-        url = self._url(path)
-        self.last_req = getattr(self.s, method)(url, **kwargs)
-        if self.check_status_code:
-            self.last_req.raise_for_status()
-        return self.last_req
-
-    def _url(self, path):
-        parts = (self.scheme, self.netloc, path, "", "")
+        check_status = kwargs.pop("raise_errors", None)
+        if check_status is None:
+            check_status = self.check_status_code
+        netloc = kwargs.pop("netloc", None)
+        idempotent = kwargs.pop("idempotent", True)
+        kwargs = self._with_context(kwargs)
+        attempt = 0
+        while True:
+            retry = idempotent and self.retry is not None and \
+                    self.retry.can_retry(method, path, kwargs, attempt)
+            try:
+                if netloc is None:
+                    resp = self._attempt(method, path, kwargs)
+                else:
+                    resp = self._send(netloc, method, path, kwargs)
+            except RetryPolicy.ERRORS:
+                if not retry:
+                    if attempt > 0:
+                        self.stats.incr("give_ups")
+                    raise
+                delay = self.retry.delay(attempt)
+            else:
+                if self.retry is None or \
+                        resp.status_code not in self.retry.statuses:
+                    break
+                if not retry:
+                    if attempt > 0:
+                        self.stats.incr("give_ups")
+                    break
+                delay = self.retry.delay(attempt, resp)
+                _close_response(resp)
+            self.stats.incr("retries")
+            time.sleep(delay)
+            attempt += 1
+        self.last_req = resp
+        if check_status:
+            resp.raise_for_status()
+        return resp
+
+    def _with_context(self, kwargs):
+        auth = getattr(self._local, "auth", None)
+        headers = getattr(self._local, "headers", None)
+        if auth is None and not headers:
+            return kwargs
+        kwargs = kwargs.copy()
+        if auth is not None:
+            kwargs.setdefault("auth", auth)
+        if headers:
+            kwargs["headers"] = dict(headers, **(kwargs.get("headers") or {}))
+        return kwargs
+
+    def netlocs(self):
+        return [self.netloc]
+
+    def _attempt(self, method, path, kwargs):
+        return self._send(self.netloc, method, path, kwargs)
+
+    def _send(self, netloc, method, path, kwargs):
+        url = self._url(path, netloc)
+        breaker = self._breaker(netloc)
+        if breaker is None:
+            return getattr(self.s, method)(url, **kwargs)
+        if not breaker.allow():
+            raise CircuitOpenError("Circuit open for %s" % netloc)
+        try:
+            resp = getattr(self.s, method)(url, **kwargs)
+        except RetryPolicy.ERRORS:
+            breaker.failure()
+            raise
+        except:
+            # Anything else says nothing about the node but must not
+            # leave a half open breaker waiting on its probe forever.
+            breaker.release()
+            raise
+        if resp.status_code >= 500:
+            breaker.failure()
+        else:
+            breaker.success()
+        return resp
+
+    def _breaker(self, netloc):
+        if self.retry is None:
+            return None
+        with self.breakers_lock:
+            if netloc not in self.breakers:
+                self.breakers[netloc] = self.retry.breaker(self.stats)
+            return self.breakers[netloc]
+
+    def _url(self, path, netloc=None):
+        parts = (self.scheme, netloc or self.netloc, path, "", "")
         return urlparse.urlunsplit(parts)
 
 
+class BalancedResource(Resource):
+    def __init__(self, scheme, netlocs, auth=None, session=None, retry=None,
+            **kwargs):
+        super(BalancedResource, self).__init__(scheme, netlocs[0],
+                auth=auth, session=session, retry=retry)
+        self.pool = NodePool(netlocs, **kwargs)
+
+    def netlocs(self):
+        return [n.netloc for n in self.pool.nodes]
+
+    def _attempt(self, method, path, kwargs):
+        node = self.pool.acquire()
+        start = time.time()
+        try:
+            resp = self._send(node.netloc, method, path, kwargs)
+        except requests.RequestException:
+            self.pool.release(node, failed=True)
+            raise
+        except Exception:
+            # Not the node's fault but it mustn't stay outstanding or,
+            # if this was its probe, stuck on probation.
+            self.pool.release(node)
+            raise
+        # Continuous and longpoll feeds hold the request open on
+        # purpose so their timings say nothing about node health.
+        latency = None
+        if (kwargs.get("params") or {}).get("feed") not in FEED_TYPES:
+            latency = time.time() - start
+        self.pool.release(node, latency, failed=resp.status_code >= 500)
+        return resp
+
+
+FEED_TYPES = ("longpoll", "continuous", "eventsource")
+
+
+class NodeStats(object):
+    def __init__(self, netloc):
+        self.netloc = netloc
+        self.outstanding = 0
+        self.latency = None
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.probation = False
+        self.probing = False
+
+    def as_dict(self):
+        return {
+            "netloc": self.netloc,
+            "outstanding": self.outstanding,
+            "latency": self.latency,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "ejected": self.ejected_until > time.time(),
+            "probation": self.probation
+        }
+
+
+class NodePool(object):
+    """\
+    Pick nodes by least outstanding requests weighted by an EWMA of
+    their latency. Nodes that fail repeatedly or drift far above the
+    pool's median latency are ejected for a while and then offered a
+    single probe request to earn their way back in.
+    """
+
+    def __init__(self, netlocs, alpha=0.3, max_failures=3, eject_time=5.0,
+            max_eject_time=60.0, slow_factor=5.0, min_samples=20):
+        if not netlocs:
+            raise ValueError("No nodes to balance across")
+        self.nodes = [NodeStats(n) for n in netlocs]
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.eject_time = eject_time
+        self.max_eject_time = max_eject_time
+        self.slow_factor = slow_factor
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.time()
+            for node in self.nodes:
+                if node.probation and not node.probing and \
+                        node.ejected_until <= now:
+                    # Back from ejection. It gets this one request and
+                    # nothing else until the answer comes in.
+                    node.probing = True
+                    return self._take(node)
+            live = [n for n in self.nodes
+                    if n.ejected_until <= now and not n.probation]
+            if not live:
+                # Everything is ejected. Rather than fail outright
+                # try whichever node is due back first.
+                live = [min(self.nodes, key=lambda n: n.ejected_until)]
+            return self._take(min(live, key=self._score))
+
+    def release(self, node, latency=None, failed=False):
+        with self.lock:
+            node.outstanding -= 1
+            if node.probing:
+                node.probing = False
+                if failed:
+                    self._eject(node)
+                    return
+                node.probation = False
+                if latency is not None:
+                    # Whatever got it ejected is stale now
+                    node.latency = latency
+                    return
+            if failed:
+                node.failures += 1
+                if node.failures >= self.max_failures:
+                    self._eject(node)
+                return
+            node.failures = 0
+            if latency is None:
+                return
+            if node.latency is None:
+                node.latency = latency
+            else:
+                node.latency += self.alpha * (latency - node.latency)
+            if self._is_slow(node):
+                self._eject(node)
+
+    def stats(self):
+        with self.lock:
+            return [n.as_dict() for n in self.nodes]
+
+    def _take(self, node):
+        node.outstanding += 1
+        node.requests += 1
+        return node
+
+    def _score(self, node):
+        latency = node.latency
+        if latency is None:
+            # Unmeasured nodes look as fast as the fastest one we
+            # know about so they get their share of traffic.
+            known = [n.latency for n in self.nodes if n.latency is not None]
+            latency = min(known) if known else 1.0
+        return ((node.outstanding + 1) * latency, random.random())
+
+    def _is_slow(self, node):
+        if self.slow_factor is None or node.requests < self.min_samples:
+            return False
+        others = sorted(n.latency for n in self.nodes
+                if n is not node and n.latency is not None)
+        if not others:
+            return False
+        median = others[len(others) / 2]
+        return node.latency > self.slow_factor * median
+
+    def _eject(self, node):
+        backoff = self.eject_time * (2 ** min(node.ejections, 16))
+        node.ejected_until = time.time() + min(backoff, self.max_eject_time)
+        node.ejections += 1
+        node.probation = True
+        node.failures = 0
+        node.requests = 0
+
+
 class Server(object):
-    def __init__(self, url, auth=None):
+    def __init__(self, url, auth=None, balance=None, retry=None,
+            gzip_threshold=None, gzip_level=6, **lbopts):
         parts = urlparse.urlsplit(url, "http", False)
         self.scheme = parts[0]
         self.netloc = parts[1]
         if parts[2] or parts[3] or parts[4]:
             raise ValueError("Invalid server URL: %s" % url)
-        self.res = Resource(self.scheme, self.netloc, auth=auth)
+        if balance:
+            netlocs = [self.netloc]
+            for peer in balance:
+                peer = urlparse.urlsplit(peer, self.scheme, False)
+                if peer[0] != self.scheme or peer[2] or peer[3] or peer[4]:
+                    raise ValueError("Invalid peer URL: %s" % peer.geturl())
+                if peer[1] not in netlocs:
+                    netlocs.append(peer[1])
+            self.res = BalancedResource(self.scheme, netlocs, auth=auth,
+                    retry=retry, **lbopts)
+        else:
+            self.res = Resource(self.scheme, self.netloc, auth=auth,
+                    retry=retry)
+        self.gzip_threshold = gzip_threshold
+        self.gzip_level = gzip_level
+        self.view_cache = None
 
     def welcome(self):
         r = self.res.get("")
-        return r.json()
+        return json_loads(r.content)
 
     def active_tasks(self):
-        return self.res.get("_active_tasks").json()
+        return json_loads(self.res.get("_active_tasks").content)
 
     def all_dbs(self):
-        return self.res.get("_all_dbs").json()
+        return json_loads(self.res.get("_all_dbs").content)
 
     def db(self, name):
         return Database(self, name)
@@ -248,8 +1312,8 @@ class Server(object):
 
     def config_delete(self, section, key, persist=False):
         path = "/".join(["_config", section, key])
-        hdrs = {"X-Couch-Persist": json.dumps(persist)}
-        return self.res.delete(path, headers=hdrs).json()
+        hdrs = {"X-Couch-Persist": json_dumps(persist)}
+        return json_loads(self.res.delete(path, headers=hdrs).content)
 
     def config_get(self, section=None, key=None):
         if section is None and key is not None:
@@ -260,12 +1324,12 @@ class Server(object):
         if key is not None:
             parts.append(key)
         path = "/".join(parts)
-        return self.res.get(path).json()
+        return json_loads(self.res.get(path).content)
 
     def config_set(self, section, key, value, persist=False):
         path = "/".join(["_config", section, key])
-        hdrs = {"X-Couch-Persist": json.dumps(persist)}
-        data = json.dumps(value)
+        hdrs = {"X-Couch-Persist": json_dumps(persist)}
+        data = json_dumps(value)
         return self.res.put(path, headers=hdrs, data=data)
 
     def user_config_get(self, username):
@@ -288,7 +1352,7 @@ class Server(object):
                 user['config'] = config
                 resp = self.res.put(
                     "_users/{0}".format(username),
-                    data=json.dumps(user)
+                    data=json_dumps(user)
                 )
                 return 200 <= self.res.last_req.status_code < 300
 
@@ -317,40 +1381,133 @@ class Server(object):
 
     @ctx.contextmanager
     def user_context(self, username, password, owner=None):
-        x_cloudant_user = owner or username
-        orig_auth = self.res.s.auth
-        orig_user = self.res.s.headers.get("X-Cloudant-User")
-        try:
-            self.res.s.auth = (username, password)
-            self.res.s.headers["X-Cloudant-User"] = x_cloudant_user
+        hdrs = {"X-Cloudant-User": owner or username}
+        with self.res.user_context((username, password), hdrs):
             yield
-        finally:
-            self.res.s.auth = orig_auth
-            if orig_user is None:
-                self.res.s.headers.pop("X-Cloudant-User")
-            else:
-                self.res.s.headers["X-Cloudant-User"] = orig_user
 
     def wait_for_indexers(self, dbname=None, design_doc=None,
-            min_delay=0.5, delay=0.25, max_delay=30.0):
+            min_delay=0.5, delay=0.25, max_delay=30.0, max_interval=1.0,
+            confirm=False, progress=None):
+        # Polls start `delay` apart and back off to `max_interval`, or
+        # sooner if the ETA says the indexers are about to finish.
+        # `max_delay` bounds the whole wait. With `confirm` the views
+        # must also report an update_seq that has caught up with the
+        # database, which replaces the blind `min_delay` sleep.
         if design_doc is not None and not design_doc.startswith("_design/"):
             design_doc = "_design/" + design_doc
+        if confirm and dbname is None:
+            raise ValueError("Confirming indexers requires a dbname")
         def _match(t):
             if t.get("type") != "indexer":
                 return False
-            if parse_shard_name(t.get("database", "")) != dbname:
-                return False
+            if dbname is not None:
+                if parse_shard_name(t.get("database", "")) != dbname:
+                    return False
             if design_doc is not None:
                 if t.get("design_document") != design_doc:
                     return False
             return True
         start = time.time()
-        if min_delay is not None:
+        if min_delay is not None and not confirm:
             time.sleep(min_delay)
-        while any(_match(t) for t in self.active_tasks()):
-            if time.time() - start > max_delay:
-                raise RuntimError("Timeout waiting for indexer tasks")
-            time.sleep(1.0)
+        tracker = IndexProgress()
+        interval = delay
+        while True:
+            remaining = max_delay - (time.time() - start)
+            tasks = self.node_tasks(timeout=max(remaining, 0.1))
+            tracker.update([t for t in tasks if _match(t)])
+            report = tracker.report()
+            if progress is not None:
+                progress(report)
+            if not report["tasks"]:
+                if not confirm or self._indexes_current(dbname, design_doc):
+                    return report
+            remaining = max_delay - (time.time() - start)
+            if remaining <= 0:
+                raise RuntimeError("Timeout waiting for indexer tasks")
+            wait = interval
+            if report["eta"] is not None:
+                wait = max(min(wait, report["eta"]), 0.05)
+            time.sleep(min(wait, remaining))
+            interval = min(interval * 1.5, max_interval)
+
+    def node_tasks(self, timeout=None):
+        # Ask every node at once and, with a `timeout`, count only the
+        # ones that answer in time. A balanced server asks each of its
+        # own nodes, which all answer for the whole cluster. The server
+        # for the configured cluster asks its nodes on their private
+        # interfaces where each one only reports its own tasks. Either
+        # way every task is counted once. Any other server just asks
+        # itself.
+        kwargs = {"raise_errors": False}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        netlocs = self.res.netlocs()
+        if len(netlocs) > 1:
+            kwargs = self.res._with_context(kwargs)
+            gets = [functools.partial(self.res.get, "_active_tasks",
+                    netloc=n, **kwargs) for n in netlocs]
+        elif self._is_cluster():
+            gets = [functools.partial(srv.res.get, "_active_tasks",
+                    **kwargs) for srv in nodes()]
+        else:
+            gets = []
+        def _get(get):
+            try:
+                r = get()
+            except requests.RequestException:
+                return None
+            if r.status_code != 200:
+                return None
+            return json_loads(r.content)
+        results = []
+        if gets:
+            executor = futures.ThreadPoolExecutor(max_workers=len(gets))
+            try:
+                fs = [executor.submit(_get, get) for get in gets]
+                done = futures.wait(fs, timeout=timeout)[0]
+            finally:
+                executor.shutdown(wait=False)
+            results = [f.result() for f in fs if f in done]
+            results = [tasks for tasks in results if tasks is not None]
+        if not results:
+            kwargs = {} if timeout is None else {"timeout": timeout}
+            return json_loads(self.res.get("_active_tasks", **kwargs).content)
+        ret, seen = [], set()
+        for tasks in results:
+            for t in tasks:
+                if "pid" in t:
+                    key = (t.get("node"), t["pid"])
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                ret.append(t)
+        return ret
+
+    def _is_cluster(self):
+        try:
+            cluster = (CONFIG.protocol, CONFIG.cluster_netloc)
+        except AttributeError:
+            return False
+        return (self.scheme, self.netloc) == cluster
+
+    def _indexes_current(self, dbname, design_doc):
+        db = self.db(dbname)
+        db_seq = _seq_number(db.info()["update_seq"])
+        if design_doc is None:
+            rows = db.all_docs(startkey="_design/", endkey="_design0").rows
+            ddocs = [row["id"] for row in rows]
+        else:
+            ddocs = [design_doc]
+        for ddocid in ddocs:
+            views = db.doc_open(ddocid).get("views")
+            if not views:
+                continue
+            v = db.view(ddocid[len("_design/"):], sorted(views)[0],
+                    stale="ok", limit=0, update_seq=True)
+            if _seq_number(v.update_seq) < db_seq:
+                return False
+        return True
 
     def last_status_code(self):
         return self.res.last_req.status_code
@@ -358,11 +1515,34 @@ class Server(object):
     def last_headers(self):
         return self.res.last_req.headers
 
+    def enable_view_cache(self, max_bytes=64 << 20):
+        self.view_cache = ViewCache(max_bytes)
+        return self.view_cache
+
+    def disable_view_cache(self):
+        self.view_cache = None
+
+    def last_compression(self):
+        return getattr(self.res.last_req, "compression", None)
+
+    def send_body(self, method, path, source, compress=True,
+            replayable=True, **kwargs):
+        threshold = self.gzip_threshold if compress else None
+        body = encode_body(source, threshold, self.gzip_level, self.res.stats,
+                replayable)
+        if isinstance(body, GzipBody):
+            hdrs = kwargs.setdefault("headers", {})
+            hdrs["Content-Encoding"] = "gzip"
+        r = getattr(self.res, method)(path, data=body, **kwargs)
+        if isinstance(body, GzipBody):
+            r.compression = body.report()
+        return r
+
     def _params(self, kwargs):
         ret = {}
         for k, v in kwargs.items():
             if not isinstance(v, basestring):
-                v = json.dumps(v)
+                v = json_dumps(v)
             ret[k] = v
         return ret
 
@@ -373,6 +1553,12 @@ class Database(object):
         if "/" in name:
             raise ValueError("Invalid database name: %s" % name)
         self.name = name
+        self.coalescer = None
+        self.bulk_get_supported = None
+        self.keys_batch_size = 1000
+        self.keys_concurrency = 4
+        self.queries_supported = None
+        self.doc_cache = None
 
     @staticmethod
     def from_url(url):
@@ -412,7 +1598,7 @@ class Database(object):
 
     def info(self, **kwargs):
         params = self._params(kwargs)
-        return self.srv.res.get(self.name, params=params).json()
+        return json_loads(self.srv.res.get(self.name, params=params).content)
 
     def compact(self, wait=False, **kwargs):
         params = self._params(kwargs)
@@ -437,13 +1623,65 @@ class Database(object):
             rev = doc_or_docid["_rev"]
         params = self._params(kwargs)
         params["rev"] = rev
-        ret = self.srv.res.delete(self.path(docid), params=params).json()
+        r = self.srv.res.delete(self.path(docid), params=params)
+        ret = json_loads(r.content)
         if isinstance(doc_or_docid, basestring):
             return ret
         else:
             doc_or_docid["_rev"] = ret["rev"]
             return doc_or_docid
 
+    def bulk_delete(self, ids_or_docs, batch_size=500, concurrency=4):
+        chunks = _chunks(ids_or_docs, batch_size)
+        ret = []
+        fetch = self.srv.res.bind(self._bulk_delete)
+        for results in _imap_ordered(fetch, chunks, concurrency):
+            ret.extend(results)
+        return ret
+
+    def _bulk_delete(self, items):
+        ret = [None] * len(items)
+        revs = {}
+        lookup = []
+        for item in items:
+            if isinstance(item, basestring):
+                lookup.append(item)
+            elif "_rev" not in item:
+                lookup.append(item["_id"])
+        if lookup:
+            for row in self.all_docs(keys=lookup).rows:
+                if "error" in row:
+                    revs[row["key"]] = {"error": row["error"]}
+                elif row["value"].get("deleted"):
+                    revs[row["key"]] = {"error": "deleted",
+                            "rev": row["value"]["rev"]}
+                else:
+                    revs[row["key"]] = {"rev": row["value"]["rev"]}
+        tombstones = []
+        for idx, item in enumerate(items):
+            if isinstance(item, basestring):
+                docid = item
+                rev = None
+            else:
+                docid = item["_id"]
+                rev = item.get("_rev")
+            if rev is None:
+                found = revs[docid]
+                if "error" in found:
+                    ret[idx] = dict(found, id=docid)
+                    continue
+                rev = found["rev"]
+            tombstones.append((idx, {"_id": docid, "_rev": rev,
+                    "_deleted": True}))
+        if not tombstones:
+            return ret
+        results = self.bulk_docs([t for _, t in tombstones])
+        for (idx, tombstone), result in zip(tombstones, results):
+            ret[idx] = result
+            if "error" not in result and isinstance(items[idx], dict):
+                items[idx]["_rev"] = result["rev"]
+        return ret
+
     def doc_exists(self, docid, **kwargs):
         params = self._params(kwargs)
         with self.srv.res.return_errors() as res:
@@ -452,26 +1690,62 @@ class Database(object):
 
     def doc_open(self, docid, **kwargs):
         params = self._params(kwargs)
-        return self.srv.res.get(self.path(docid), params=params).json()
+        r = self.srv.res.get(self.path(docid), params=params)
+        return json_loads(r.content)
 
     def doc_save(self, doc, **kwargs):
+        # Batches mix saves from every thread so anything saved under a
+        # user context or return_errors has to go on its own.
+        if self.coalescer is not None and not kwargs and \
+                not self.srv.res.in_context():
+            f = self.coalescer.save(doc)
+            try:
+                return f.result()
+            finally:
+                # Point last_req at the batch that carried this save or,
+                # if it failed, this doc's part of it
+                if f.resp is not None:
+                    self.srv.res.last_req = f.resp
         if "_id" not in doc:
             path = self.path()
-            func = self.srv.res.post
+            method = "post"
         else:
             path = self.path(quote(doc["_id"]))
-            func = self.srv.res.put
+            method = "put"
         params = self._params(kwargs)
-        r = func(path, data=json.dumps(doc), params=params)
-        doc["_id"] = r.json()["id"]
-        doc["_rev"] = r.json()["rev"]
+        r = self.srv.send_body(method, path, lambda: _iter_json(doc),
+                params=params)
+        ret = json_loads(r.content)
+        doc["_id"] = ret["id"]
+        doc["_rev"] = ret["rev"]
         return doc
 
     def bulk_docs(self, docs, **kwargs):
+        return self._bulk_docs(docs, lambda: _iter_bulk_docs(docs), kwargs)
+
+    def bulk_writer(self, **kwargs):
+        return BulkWriter(self, **kwargs)
+
+    def start_coalescing(self, **kwargs):
+        if self.coalescer is not None:
+            raise RuntimeError("Already coalescing doc saves")
+        self.coalescer = SaveCoalescer(self, **kwargs)
+        return self.coalescer
+
+    def stop_coalescing(self):
+        coalescer, self.coalescer = self.coalescer, None
+        if coalescer is not None:
+            coalescer.close()
+
+    def _bulk_docs(self, docs, source, kwargs):
         params = self._params(kwargs)
-        data = json.dumps({"docs": docs})
-        r = self.srv.res.post(self.path("_bulk_docs"), params=params, data=data)
-        ret = r.json()
+        path = self.path("_bulk_docs")
+        # The server picks a new id for a doc without one on every
+        # attempt so replaying the request could create it twice.
+        idempotent = all("_id" in doc for doc in docs)
+        r = self.srv.send_body("post", path, source, params=params,
+                idempotent=idempotent)
+        ret = json_loads(r.content)
         for idx, result in enumerate(ret):
             if "error" in result:
                 continue
@@ -479,44 +1753,347 @@ class Database(object):
             docs[idx]["_rev"] = result["rev"]
         return ret
 
-    def view(self, ddoc, vname, **kwargs):
-        path = self.path("_design", ddoc, "_view", vname)
-        return self._exec_view(path, **kwargs)
-
-    def changes(self, **kwargs):
-        is_continuous = kwargs.get("feed") == "continuous"
+    def attachment_put(self, docid, name, data,
+            content_type="application/octet-stream", rev=None, **kwargs):
+        path = self.path(quote(docid), quote(name))
         params = self._params(kwargs)
-        r = self.srv.res.get(self.path("_changes"), params=params, stream=True)
-        return Changes(self, r, is_continuous)
+        if rev is not None:
+            params["rev"] = rev
+        hdrs = {"Content-Type": content_type}
+        compress = content_type.startswith(COMPRESSIBLE_TYPES)
+        source, replayable = _data_source(data)
+        r = self.srv.send_body("put", path, source, compress=compress,
+                replayable=replayable, params=params, headers=hdrs)
+        return json_loads(r.content)
 
-    def wait_for_indexers(self, **kwargs):
-        self.srv.wait_for_indexers(dbname=self.name, **kwargs)
+    def docs_get(self, ids, revs=None, batch_size=100, concurrency=4):
+        if revs is None:
+            reqs = ((docid, None) for docid in ids)
+        else:
+            reqs = itertools.izip(ids, revs)
+        chunks = _chunks(reqs, batch_size)
+        fetch = self.srv.res.bind(self._docs_get)
+        for results in _imap_ordered(fetch, chunks, concurrency):
+            for result in results:
+                yield result
 
-    def wait_for_change(self, since, timeout=5000):
-        c = self.changes(
-                feed="longpoll",
-                limit=1,
-                since=since,
-                timeout=timeout
-            )
-        if not len(c.results):
-            raise RuntimeError("No change")
-        return c.last_seq
+    def _docs_get(self, reqs):
+        if self.bulk_get_supported is not False:
+            results = self._bulk_get(reqs)
+            if results is not None:
+                self.bulk_get_supported = True
+                return results
+            self.bulk_get_supported = False
+        return self._keyed_get(reqs)
 
-    def last_status_code(self):
-        return self.srv.last_status_code()
+    def _bulk_get(self, reqs):
+        docs = []
+        for docid, rev in reqs:
+            if rev is None:
+                docs.append({"id": docid})
+            else:
+                docs.append({"id": docid, "rev": rev})
+        data = json_dumps({"docs": docs})
+        r = self.srv.res.post(self.path("_bulk_get"), data=data,
+                raise_errors=False)
+        if not self.bulk_get_supported and _endpoint_missing(r):
+            return None
+        r.raise_for_status()
+        ret = []
+        results = json_loads(r.content)["results"]
+        for (docid, rev), result in zip(reqs, results):
+            # Without open_revs=all there's exactly one entry per request
+            entry = result["docs"][0]
+            if "ok" in entry:
+                ret.append(_doc_result(docid, entry["ok"]))
+            elif entry["error"].get("reason") == "deleted":
+                ret.append({"id": docid, "rev": rev, "error": "deleted"})
+            else:
+                error = entry["error"]
+                ret.append({
+                    "id": docid,
+                    "rev": rev,
+                    "error": error.get("error", "not_found"),
+                    "reason": error.get("reason")
+                })
+        return ret
 
-    def last_headers(self):
-        return self.srv.last_headers()
+    def _keyed_get(self, reqs):
+        keys = [docid for docid, _ in reqs]
+        rows = self.all_docs(keys=keys, include_docs=True).rows
+        ret = []
+        for (docid, rev), row in zip(reqs, rows):
+            if "error" in row:
+                ret.append({"id": docid, "rev": rev, "error": row["error"]})
+            elif rev is not None and row["value"]["rev"] != rev:
+                ret.append(self._rev_get(docid, rev))
+            elif row["value"].get("deleted"):
+                currev = row["value"]["rev"]
+                ret.append({"id": docid, "rev": currev, "error": "deleted"})
+            else:
+                ret.append(_doc_result(docid, row["doc"]))
+        return ret
 
-    def get_security(self):
-        return self.srv.res.get(self.path("_security")).json()
+    def _rev_get(self, docid, rev):
+        r = self.srv.res.get(self.path(quote(docid)), params={"rev": rev},
+                raise_errors=False)
+        if r.status_code == 404:
+            return {"id": docid, "rev": rev, "error": "not_found"}
+        r.raise_for_status()
+        return _doc_result(docid, json_loads(r.content))
 
-    def set_security(self, props):
-        curr = self.get_security()
-        if curr != props:
-            with self.srv.res.return_errors() as res:
-                res.put(self.path("_security"), data=json.dumps(props))
+    def attach_docs(self, rows, batch_size=100, window=4, cache=None,
+            all_docs=False):
+        # Fetch bodies for view or changes rows read without
+        # include_docs. Up to `window` batches are fetched ahead of the
+        # rows being yielded and rows come back in their original order.
+        # Pass `all_docs` for _all_docs rows so the rev in their value
+        # is fetched rather than the current one.
+        if cache is None:
+            cache = self.doc_cache
+        fetch = self.srv.res.bind(
+                lambda b: self._attach_docs(b, cache, all_docs))
+        batches = _chunks(rows, batch_size)
+        for batch in _imap_ordered(fetch, batches, window):
+            for row in batch:
+                yield row
+
+    def _attach_docs(self, rows, cache, all_docs):
+        wanted = collections.OrderedDict()
+        for row in rows:
+            ref = _doc_ref(row, all_docs)
+            if ref is None or "doc" in row:
+                continue
+            if cache is not None and ref[1] is not None:
+                doc = cache.get(*ref)
+                if doc is not None:
+                    row["doc"] = doc
+                    continue
+            wanted.setdefault(ref, []).append(row)
+        if not wanted:
+            return rows
+        for ref, result in zip(wanted, self._docs_get(list(wanted))):
+            doc = result.get("doc")
+            if doc is None and result.get("error") == "deleted":
+                rev = result.get("rev") or ref[1]
+                doc = {"_id": ref[0], "_rev": rev, "_deleted": True}
+            if doc is not None and cache is not None:
+                cache.put(doc)
+            for row in wanted[ref]:
+                row["doc"] = doc
+        return rows
+
+    def view(self, ddoc, vname, **kwargs):
+        path = self.path("_design", ddoc, "_view", vname)
+        return self._exec_view(path, **kwargs)
+
+    def view_queries(self, ddoc, vname, queries, concurrency=4, **kwargs):
+        path = self.path("_design", ddoc, "_view", vname)
+        return self._exec_queries(path, queries, concurrency, kwargs)
+
+    def all_docs_queries(self, queries, concurrency=4, **kwargs):
+        path = self.path("_all_docs")
+        return self._exec_queries(path, queries, concurrency, kwargs)
+
+    def _exec_queries(self, path, queries, concurrency, kwargs):
+        # Yields one ViewResult per query, in order. Servers without
+        # the queries endpoint get each query as its own request.
+        queries = list(queries)
+        if self.queries_supported is not False:
+            results = self._post_queries(path, queries, kwargs)
+            if results is not None:
+                self.queries_supported = True
+                return results
+            self.queries_supported = False
+
+        def fetch(query):
+            args = kwargs.copy()
+            args.update(query)
+            v = self._exec_view(path, **args)
+            v.rows
+            return v
+        return _imap_ordered(self.srv.res.bind(fetch), queries, concurrency)
+
+    def _post_queries(self, path, queries, kwargs):
+        data = json_dumps({"queries": queries})
+        r = self.srv.res.post(path + "/queries", data=data,
+                params=self._params(kwargs), stream=True, raise_errors=False)
+        if r.status_code in (400, 404, 405, 501) and \
+                not self.queries_supported:
+            _close_response(r)
+            return None
+        r.raise_for_status()
+        return self._iter_queries(r)
+
+    def _iter_queries(self, r):
+        # The results share one response so each is read row by row
+        # off the same stream. Moving on to the next query reads in
+        # whatever is left of the one before.
+        events = iter_json_events(_iter_chunks(r), ("results",),
+                item_keys=("rows",))
+        fields = {}
+        for kind, key, value in events:
+            if kind == "begin":
+                result = ViewResult(self, None, events=_until_end(events))
+                yield result
+                result._buffer()
+            elif kind == "item":
+                raise ValueError("Invalid query result: %r" % (value,))
+            else:
+                fields[key] = value
+        if "error" in fields:
+            args = (fields["error"], fields.get("reason"))
+            raise RuntimeError("Error in view result: %s: %s" % args)
+
+    def scan_view(self, ddoc, vname, **kwargs):
+        path = self.path("_design", ddoc, "_view", vname)
+        return ViewScanner(self, path, **kwargs)
+
+    def scan_all_docs(self, **kwargs):
+        return ViewScanner(self, self.path("_all_docs"), **kwargs)
+
+    def parallel_scan(self, ddoc=None, vname=None, ranges=4,
+            split_points=None, ordered=False, page_size=None,
+            shard_map=None, server_for=None, **kwargs):
+        if ddoc is None:
+            parts = ("_all_docs",)
+        else:
+            parts = ("_design", ddoc, "_view", vname)
+        path = self.path(*parts)
+        for arg in ("keys", "key", "skip", "limit", "descending"):
+            if arg in kwargs:
+                raise ValueError("'%s' is not supported by scans" % arg)
+        if split_points is None:
+            bounded = [k for k in kwargs if k.startswith(("start", "end"))]
+            if bounded:
+                raise ValueError("Sampled splits need the whole index")
+            points = self._split_points(parts, ranges, kwargs, shard_map,
+                    server_for)
+        else:
+            points = [{"key": k} for k in split_points]
+        bounds = [None] + points + [None]
+        funcs = []
+        for lo, hi in zip(bounds, bounds[1:]):
+            args = self._range_args(lo, hi, kwargs)
+            if page_size is not None:
+                func = lambda a=args: ViewScanner(self, path,
+                        page_size=page_size, **a)
+            else:
+                func = lambda a=args: self._exec_view(path, **a)
+            funcs.append(func)
+        if not ordered:
+            return _interleave(funcs, bind=self.srv.res.bind)
+        # Ranges are disjoint and sorted so reading each one to the end
+        # in turn gives index order. Later ranges keep filling their
+        # buffers in the meantime.
+        executor = futures.ThreadPoolExecutor(max_workers=len(funcs))
+        streams = [AsyncStream(executor, f, bind=self.srv.res.bind)
+                for f in funcs]
+        return self._drain(streams, executor)
+
+    def _drain(self, streams, executor):
+        try:
+            for stream in streams:
+                for row in stream:
+                    yield row
+        finally:
+            for stream in streams:
+                stream.close()
+            executor.shutdown(wait=False)
+
+    def _split_points(self, parts, ranges, kwargs, shard_map=None,
+            server_for=None):
+        # Documents are spread over the shards by hash so any one shard
+        # is an even sample of the whole index. Reading one copy straight
+        # through on its node costs about 1/q of the scan it splits, where
+        # skip through the cluster makes every shard stream all the rows
+        # before the one asked for.
+        if ranges < 2:
+            return []
+        if shard_map is None:
+            shard_map = get_shard_map(self.name)
+        if server_for is None:
+            server_for = lambda node: get_server(node=node)
+        rng, nodes = min(shard_map["by_range"].items())
+        suffix = "".join(chr(c) for c in shard_map["shard_suffix"])
+        name = "shards/%s/%s%s" % (rng, urllib.unquote(self.name), suffix)
+        shard = server_for(random.choice(nodes)).db(quote(name))
+        args = dict((k, v) for k, v in kwargs.items()
+                if k not in ("include_docs", "conflicts", "attachments"))
+        v = shard._exec_view(shard.path(*parts), **args)
+        try:
+            total = v.total_rows
+            if not total:
+                return []
+            ranks = sorted(set(total * i // ranges for i in range(1, ranges)))
+            points = []
+            for i, row in enumerate(v):
+                if i != ranks[0]:
+                    continue
+                point = {"key": row["key"], "id": row.get("id")}
+                if point not in points:
+                    points.append(point)
+                ranks.pop(0)
+                if not ranks:
+                    break
+            return points
+        finally:
+            v.close()
+
+    def _range_args(self, lo, hi, kwargs):
+        args = kwargs.copy()
+        if lo is not None:
+            args["startkey"] = lo["key"]
+            if lo.get("id") is not None:
+                args["startkey_docid"] = lo["id"]
+        if hi is not None:
+            args["endkey"] = hi["key"]
+            if hi.get("id") is not None:
+                args["endkey_docid"] = hi["id"]
+            args["inclusive_end"] = False
+        return args
+
+    def changes(self, **kwargs):
+        is_continuous = kwargs.get("feed") == "continuous"
+        params = self._params(kwargs)
+        r = self.srv.res.get(self.path("_changes"), params=params, stream=True)
+        return Changes(self, r, is_continuous)
+
+    def follow_changes(self, **kwargs):
+        return ChangesFollower(self, **kwargs)
+
+    def shard_changes(self, **kwargs):
+        return ShardChanges(self.name, **kwargs)
+
+    def wait_for_indexers(self, **kwargs):
+        return self.srv.wait_for_indexers(dbname=self.name, **kwargs)
+
+    def wait_for_change(self, since, timeout=5000):
+        c = self.changes(
+                feed="longpoll",
+                limit=1,
+                since=since,
+                timeout=timeout
+            )
+        if not len(c.results):
+            raise RuntimeError("No change")
+        return c.last_seq
+
+    def last_status_code(self):
+        return self.srv.last_status_code()
+
+    def last_headers(self):
+        return self.srv.last_headers()
+
+    def get_security(self):
+        r = self.srv.res.get(self.path("_security"))
+        return json_loads(r.content)
+
+    def set_security(self, props):
+        curr = self.get_security()
+        if curr != props:
+            with self.srv.res.return_errors() as res:
+                res.put(self.path("_security"), data=json_dumps(props))
                 return True
         else:
             return True
@@ -525,41 +2102,1198 @@ class Database(object):
         data = None
         func = self.srv.res.get
         if "keys" in kwargs:
-            data = json.dumps({"keys":kwargs.pop("keys")})
+            keys = kwargs.pop("keys")
+            if len(keys) > self.keys_batch_size:
+                return self._exec_keys(path, keys, kwargs)
+            data = json_dumps({"keys":keys})
             func = self.srv.res.post
         params = self._params(kwargs)
-        r = func(path, data=data, params=params, stream=True)
-        return ViewResult(self, r)
+        cache = self.srv.view_cache
+        if cache is None:
+            r = func(path, data=data, params=params, stream=True)
+            return ViewResult(self, r)
+        key = cache.key(path, params, data)
+        entry = cache.get(key)
+        hdrs = {}
+        if entry is not None:
+            hdrs["If-None-Match"] = entry[0]
+        r = func(path, data=data, params=params, headers=hdrs, stream=True)
+        if entry is not None and r.status_code == 304:
+            cache.stats.incr("hits")
+            _close_response(r)
+            events = iter_json_events([entry[1]], ("rows",))
+            return ViewResult(self, r, events=events)
+        chunks = _iter_chunks(r)
+        etag = r.headers.get("ETag")
+        if r.status_code == 200 and etag is not None:
+            chunks = cache.tee(key, etag, chunks)
+        return ViewResult(self, r, events=iter_json_events(chunks, ("rows",)))
+
+    def _exec_keys(self, path, keys, kwargs):
+        # Request each distinct key once, in parallel batches, and
+        # expand the rows back out to the order and multiplicity of
+        # the original list. skip and limit apply to the expanded rows.
+        skip = int(kwargs.pop("skip", 0))
+        limit = kwargs.pop("limit", None)
+        ids = [_key_id(k) for k in keys]
+        index, last, unique = {}, {}, []
+        for i, (k, kid) in enumerate(zip(keys, ids)):
+            if kid not in index:
+                index[kid] = len(unique)
+                unique.append(k)
+            last[kid] = i
+
+        def fetch(batch):
+            v = self._exec_view(path, keys=batch, **kwargs)
+            return v, _group_rows(batch, v.rows)
+
+        def events():
+            batches = _chunks(unique, self.keys_batch_size)
+            results = _imap_ordered(self.srv.res.bind(fetch), batches,
+                    self.keys_concurrency)
+            groups = {}
+            for i, kid in enumerate(ids):
+                while index[kid] not in groups:
+                    v, grouped = next(results)
+                    if not groups:
+                        for name, value in v._fields.items():
+                            yield ("field", name, value)
+                    for rows in grouped:
+                        groups[len(groups)] = rows
+                rows = groups[index[kid]]
+                if last[kid] == i:
+                    groups[index[kid]] = None
+                for row in rows:
+                    yield ("item", "rows", row)
+
+        items = events()
+        if skip or limit is not None:
+            stop = None if limit is None else skip + int(limit)
+            items = _slice_rows(items, skip, stop)
+        return ViewResult(self, None, events=items)
 
     def _params(self, kwargs):
         ret = {}
         for k, v in kwargs.items():
             if k in ("key", "startkey", "start_key", "endkey", "end_key"):
-                ret[k] = json.dumps(v)
+                ret[k] = json_dumps(v)
             elif not isinstance(v, basestring):
-                ret[k] = json.dumps(v)
+                ret[k] = json_dumps(v)
             else:
                 ret[k] = v
         return ret
 
 
+class BulkWriter(object):
+    """\
+    Accept docs one at a time and write them through _bulk_docs in
+    batches cut by doc count or encoded size, keeping up to
+    `concurrency` batches in flight. Adding docs blocks once that many
+    batches are outstanding.
+    """
+
+    def __init__(self, db, batch_size=500, max_bytes=4 << 20,
+            concurrency=4, **kwargs):
+        self.db = db
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.kwargs = kwargs
+        self.executor = futures.ThreadPoolExecutor(max_workers=concurrency)
+        self.slots = threading.Semaphore(concurrency)
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.docs = []
+        self.encoded = []
+        self.nbytes = 0
+        self.written = 0
+        self.errors = []
+        self.conflicts = []
+        self.failures = []
+        self.batches = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.started = None
+        self.finished = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.close(flush=False)
+
+    def add(self, doc):
+        if self.started is None:
+            self.started = time.time()
+        encoded = json_dumps(doc)
+        if self.docs and self.nbytes + len(encoded) > self.max_bytes:
+            self.flush()
+        self.docs.append(doc)
+        self.encoded.append(encoded)
+        self.nbytes += len(encoded)
+        if len(self.docs) >= self.batch_size:
+            self.flush()
+
+    def extend(self, docs):
+        for doc in docs:
+            self.add(doc)
+
+    def flush(self):
+        if not self.docs:
+            return
+        docs, encoded = self.docs, self.encoded
+        self.docs, self.encoded, self.nbytes = [], [], 0
+        self.slots.acquire()
+        try:
+            write = self.db.srv.res.bind(self._write)
+            f = self.executor.submit(write, docs, encoded)
+        except:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.pending.add(f)
+        f.add_done_callback(self._done)
+
+    def close(self, flush=True):
+        if flush:
+            self.flush()
+        with self.lock:
+            pending = list(self.pending)
+        futures.wait(pending)
+        self.executor.shutdown()
+        if self.finished is None:
+            self.finished = time.time()
+        if flush and self.failures:
+            raise self.failures[0][1]
+
+    def stats(self):
+        with self.lock:
+            end = self.finished or time.time()
+            elapsed = end - (self.started or end)
+            return {
+                "docs": self.written,
+                "errors": len(self.errors),
+                "conflicts": len(self.conflicts),
+                "failed_batches": len(self.failures),
+                "batches": self.batches,
+                "elapsed": elapsed,
+                "docs_per_sec": self.written / elapsed if elapsed else 0.0,
+                "batch_latency_avg": self.latency_total / (self.batches or 1),
+                "batch_latency_max": self.latency_max
+            }
+
+    def _write(self, docs, encoded):
+        start = time.time()
+        try:
+            source = lambda: _iter_bulk_body(encoded)
+            ret = self.db._bulk_docs(docs, source, self.kwargs)
+        except Exception as e:
+            with self.lock:
+                self.failures.append((docs, e))
+            return
+        latency = time.time() - start
+        with self.lock:
+            self.batches += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            for doc, result in zip(docs, ret):
+                if "error" not in result:
+                    self.written += 1
+                elif result["error"] == "conflict":
+                    self.conflicts.append((doc, result))
+                else:
+                    self.errors.append((doc, result))
+
+    def _done(self, f):
+        with self.lock:
+            self.pending.discard(f)
+        self.slots.release()
+
+
+def _endpoint_missing(r):
+    # Servers without an endpoint refuse the method or take its name for
+    # a doc id. A missing database or a bad request to an endpoint that
+    # is there is an error like any other.
+    if r.status_code in (405, 501):
+        return True
+    if r.status_code not in (400, 404):
+        return False
+    try:
+        body = json_loads(r.content)
+    except ValueError:
+        return False
+    if not isinstance(body, dict):
+        return False
+    if r.status_code == 404:
+        return body.get("error") == "not_found" and \
+                body.get("reason") == "missing"
+    return body.get("error") == "illegal_docid" or \
+            "underscore" in (body.get("reason") or "")
+
+
+def _doc_ref(row, all_docs=False):
+    # The (id, rev) include_docs would attach to a view, _all_docs or
+    # changes row. A rev of None means the current revision. A view's
+    # value is the user's own so only an _all_docs value names a rev.
+    value = row.get("value")
+    if isinstance(value, dict) and "_id" in value:
+        return (value["_id"], value.get("_rev"))
+    if "id" not in row:
+        return None
+    if row.get("changes"):
+        return (row["id"], row["changes"][0]["rev"])
+    if all_docs and isinstance(value, dict) and "rev" in value:
+        return (row["id"], value["rev"])
+    return (row["id"], None)
+
+
+def _doc_result(docid, doc):
+    if doc.get("_deleted"):
+        return {"id": docid, "rev": doc["_rev"], "error": "deleted",
+                "doc": doc}
+    return {"id": docid, "rev": doc["_rev"], "doc": doc}
+
+
+class DocError(requests.HTTPError):
+    STATUS_CODES = {
+        "conflict": 409,
+        "forbidden": 403,
+        "unauthorized": 401,
+        "not_found": 404
+    }
+
+    def __init__(self, result, resp=None):
+        self.result = result
+        self.error = result.get("error")
+        self.reason = result.get("reason")
+        self.status_code = self.STATUS_CODES.get(self.error, 400)
+        msg = "%s: %s (%s)" % (result.get("id"), self.error, self.reason)
+        super(DocError, self).__init__(msg, response=self._response(resp))
+
+    def _response(self, resp):
+        # The doc's own status and result on the batch's request, so it
+        # reads like the error a single doc_save would have raised
+        ret = requests.Response()
+        ret.status_code = self.status_code
+        ret.headers["Content-Type"] = "application/json"
+        ret.encoding = "utf-8"
+        ret._content = json_dumps(self.result)
+        if resp is not None:
+            ret.url = resp.url
+            ret.request = resp.request
+            ret.raw = resp.raw
+        return ret
+
+
+class DocCache(object):
+    """\
+    LRU of doc bodies keyed on (id, rev). A revision never changes once
+    written so entries stay valid until they are evicted.
+    """
+
+    def __init__(self, max_docs=10000):
+        self.max_docs = max_docs
+        self.docs = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = Counters()
+
+    def get(self, docid, rev):
+        with self.lock:
+            doc = self.docs.pop((docid, rev), None)
+            if doc is None:
+                self.stats.incr("misses")
+                return None
+            self.docs[(docid, rev)] = doc
+            self.stats.incr("hits")
+            return doc
+
+    def put(self, doc):
+        with self.lock:
+            self.docs.pop((doc["_id"], doc["_rev"]), None)
+            self.docs[(doc["_id"], doc["_rev"])] = doc
+            while len(self.docs) > self.max_docs:
+                self.docs.popitem(last=False)
+                self.stats.incr("evictions")
+
+    def clear(self):
+        with self.lock:
+            self.docs.clear()
+
+
+class IndexProgress(object):
+    """\
+    Track changes_done and total_changes of indexer tasks per shard
+    between polls to estimate throughput and time remaining. Shards
+    whose task disappears are counted as complete.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.shards = {}
+        self.tasks = 0
+        self.rate = None
+        self.last = None
+
+    def update(self, tasks):
+        now = time.time()
+        shards = {}
+        for key, (done, total) in self.shards.items():
+            shards[key] = (max(done, total), max(done, total))
+        running = set()
+        for t in tasks:
+            key = (t.get("node"), t.get("database"), t.get("design_document"))
+            shards[key] = (t.get("changes_done", 0), t.get("total_changes", 0))
+            running.add(key)
+        self.shards = shards
+        self.tasks = len(running)
+        done = sum(d for d, _ in shards.values())
+        if self.last is not None and now > self.last[0]:
+            rate = max(done - self.last[1], 0) / (now - self.last[0])
+            if self.rate is None:
+                self.rate = rate
+            else:
+                self.rate = 0.5 * rate + 0.5 * self.rate
+        self.last = (now, done)
+
+    def report(self):
+        done = sum(d for d, _ in self.shards.values())
+        total = sum(t for _, t in self.shards.values())
+        eta = None
+        if total <= done:
+            eta = 0.0
+        elif self.rate:
+            eta = (total - done) / self.rate
+        return {
+            "tasks": self.tasks,
+            "shards": len(self.shards),
+            "changes_done": done,
+            "total_changes": total,
+            "rate": self.rate,
+            "eta": eta,
+            "elapsed": time.time() - self.start
+        }
+
+
+class SaveCoalescer(object):
+    """\
+    Merge doc_save calls from many threads into _bulk_docs requests.
+    Saves are held for up to `window` seconds or until `batch_size`
+    have arrived. A batch never carries two updates to the same doc id
+    and an id is not sent again until its previous batch has finished
+    so updates to one doc apply in the order they were submitted.
+    """
+
+    def __init__(self, db, window=0.001, batch_size=100, concurrency=4):
+        self.db = db
+        self.window = window
+        self.batch_size = batch_size
+        self.executor = futures.ThreadPoolExecutor(max_workers=concurrency)
+        self.slots = threading.Semaphore(concurrency)
+        self.cond = threading.Condition()
+        self.queue = []
+        self.inflight = set()
+        self.closed = False
+        self.stats = Counters()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def save(self, doc):
+        f = futures.Future()
+        f.resp = None
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("Coalescer is closed")
+            self.queue.append((doc, f))
+            self.cond.notify_all()
+        return f
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+        self.executor.shutdown()
+
+    def _run(self):
+        while True:
+            self.slots.acquire()
+            with self.cond:
+                batch = self._next_batch()
+            if batch is None:
+                self.slots.release()
+                return
+            ids = set(doc["_id"] for doc, _ in batch if "_id" in doc)
+            f = self.executor.submit(self._write, batch)
+            f.add_done_callback(lambda f, ids=ids: self._done(ids))
+
+    def _next_batch(self):
+        while True:
+            while not self._ready() and not self.closed:
+                self.cond.wait()
+            if not self.queue:
+                return None
+            # Hold the first arrival for up to a window to pick up more
+            deadline = time.time() + self.window
+            while len(self.queue) < self.batch_size and not self.closed:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch = self._take()
+            if batch:
+                return batch
+            # Everything queued is waiting on an in-flight update
+            self.cond.wait()
+
+    def _ready(self):
+        return any(self._takeable(doc) for doc, _ in self.queue)
+
+    def _takeable(self, doc):
+        return "_id" not in doc or doc["_id"] not in self.inflight
+
+    def _take(self):
+        batch = []
+        rest = []
+        ids = set()
+        for doc, f in self.queue:
+            docid = doc.get("_id")
+            full = len(batch) >= self.batch_size
+            if full or docid in ids or not self._takeable(doc):
+                rest.append((doc, f))
+                continue
+            if docid is not None:
+                ids.add(docid)
+                self.inflight.add(docid)
+            batch.append((doc, f))
+        self.queue = rest
+        return batch
+
+    def _write(self, batch):
+        docs = [doc for doc, _ in batch]
+        self.stats.incr("batches")
+        self.stats.incr("docs", len(docs))
+        res = self.db.srv.res
+        res.last_req = None
+        try:
+            ret = self.db.bulk_docs(docs)
+        except Exception as e:
+            for _, f in batch:
+                f.resp = res.last_req
+                f.set_exception(e)
+            return
+        for (doc, f), result in zip(batch, ret):
+            f.resp = res.last_req
+            if "error" in result:
+                e = DocError(result, res.last_req)
+                f.resp = e.response
+                f.set_exception(e)
+            else:
+                f.set_result(doc)
+
+    def _done(self, ids):
+        with self.cond:
+            self.inflight.difference_update(ids)
+            self.cond.notify_all()
+        self.slots.release()
+
+
+CHUNK_SIZE = 65536
+FEED_CHUNK_SIZE = 512
+
+_WS_RE = re.compile(r"[ \t\n\r]*")
+_STRUCT_RE = re.compile(r'["\[\]{}]')
+_STRING_RE = re.compile(r'["\\]')
+_SCALAR_END_RE = re.compile(r"[ \t\n\r,\]}]")
+
+
+class JSONStreamParser(object):
+    """\
+    Incremental JSON parser for CouchDB responses. Chunks can split the
+    body anywhere and whitespace is irrelevant. Members of the top-level
+    object are returned as ("field", key, value) events except for
+    arrays named in `stream_keys` whose elements are returned one at a
+    time as ("item", key, value). With `multi` the body is instead a
+    sequence of top-level values, as in continuous feeds, returned as
+    ("value", None, value).
+
+    With `item_keys` the object elements of a streamed array are read
+    a member at a time too, between ("begin", key, None) and ("end",
+    key, None) events, and their arrays named in `item_keys` streamed.
+    This is how multi-query results are read row by row.
+
+    Only the value currently being read is buffered.
+    """
+
+    def __init__(self, stream_keys=(), multi=False, item_keys=()):
+        self.stream_keys = frozenset(stream_keys)
+        self.item_keys = frozenset(item_keys)
+        self.multi = multi
+        self.buf = ""
+        self.pos = 0
+        self.state = "value" if multi else "start"
+        self.key = None
+        self.outer = None
+        self.vstart = None
+        self.vpos = 0
+        self.vdepth = 0
+        self.vstr = False
+        self.vparts = []
+
+    def parse(self, chunks):
+        for chunk in chunks:
+            for event in self.feed(chunk):
+                yield event
+        for event in self.finish():
+            yield event
+
+    def feed(self, chunk):
+        if self.vstart is not None:
+            # Part way through a value. Set aside what has been scanned
+            # and join it once the value is complete, copying the whole
+            # of it on every chunk would be quadratic. The opening
+            # character stays put to say what kind of value it is.
+            buf = self.buf
+            self.vparts.append(buf[self.vstart + 1:self.vpos])
+            self.buf = buf[self.vstart] + buf[self.vpos:] + chunk
+            self.pos = self.vstart = 0
+            self.vpos = 1
+        else:
+            self.buf = self.buf[self.pos:] + chunk
+            self.pos = 0
+        return self._events(False)
+
+    def finish(self):
+        events = self._events(True)
+        if self.state not in ("done", "value") or self.vstart is not None:
+            raise ValueError("Truncated JSON stream")
+        return events
+
+    def _events(self, eof):
+        ret = []
+        buf = self.buf
+        while True:
+            self.pos = _WS_RE.match(buf, self.pos).end()
+            if self.pos >= len(buf):
+                return ret
+            c = buf[self.pos]
+            state = self.state
+            if state == "start":
+                if c != "{":
+                    raise ValueError("Expected a JSON object: %r" % c)
+                self.pos += 1
+                self.state = "key"
+            elif state in ("key", "next_key"):
+                if c == "}" and self.outer is not None:
+                    self.pos += 1
+                    ret.append(("end", self.outer, None))
+                    self.key = self.outer
+                    self.outer = None
+                    self.state = "next_item"
+                elif c == "}":
+                    self.pos += 1
+                    self.state = "done"
+                elif c == "," and state == "next_key":
+                    self.pos += 1
+                    self.state = "key"
+                elif c == '"':
+                    found = self._value(eof)
+                    if found is None:
+                        return ret
+                    self.pos, self.key = found
+                    self.state = "colon"
+                else:
+                    raise ValueError("Invalid JSON at %r" % buf[self.pos:])
+            elif state == "colon":
+                if c != ":":
+                    raise ValueError("Expected ':' at %r" % buf[self.pos:])
+                self.pos += 1
+                self.state = "member"
+            elif state == "member":
+                if self.outer is None:
+                    keys = self.stream_keys
+                else:
+                    keys = self.item_keys
+                if c == "[" and self.key in keys:
+                    self.pos += 1
+                    self.state = "items"
+                    continue
+                found = self._value(eof)
+                if found is None:
+                    return ret
+                self.pos, value = found
+                ret.append(("field", self.key, value))
+                self.state = "next_key"
+            elif state in ("items", "next_item"):
+                if c == "]":
+                    self.pos += 1
+                    self.state = "next_key"
+                    continue
+                if state == "next_item":
+                    if c != ",":
+                        raise ValueError("Expected ',' at %r" % buf[self.pos:])
+                    self.pos += 1
+                    self.state = "items"
+                    continue
+                if c == "{" and self.item_keys and self.outer is None:
+                    self.pos += 1
+                    ret.append(("begin", self.key, None))
+                    self.outer = self.key
+                    self.state = "key"
+                    continue
+                found = self._value(eof)
+                if found is None:
+                    return ret
+                self.pos, value = found
+                ret.append(("item", self.key, value))
+                self.state = "next_item"
+            elif state == "value":
+                found = self._value(eof)
+                if found is None:
+                    return ret
+                self.pos, value = found
+                ret.append(("value", None, value))
+            else:
+                raise ValueError("Unexpected data after JSON: %r" % c)
+
+    def _value(self, eof):
+        # Values that fit in the buffer are decoded in place. Only one
+        # that runs off the end of the buffer needs to be scanned.
+        buf = self.buf
+        raw_decode = JSON.raw_decode
+        if raw_decode is not None and self.vstart != self.pos:
+            try:
+                value, end = raw_decode(buf, self.pos)
+            except ValueError:
+                pass
+            else:
+                # Numbers are only complete once we see what follows them
+                if buf[self.pos] in '{["' or eof:
+                    return end, value
+                if end < len(buf) and buf[end] in " \t\n\r,]}":
+                    return end, value
+                return None
+        end = self._scan(eof)
+        if end is None:
+            return None
+        if self.vparts:
+            parts = [buf[self.pos]] + self.vparts + [buf[self.pos + 1:end]]
+            self.vparts = []
+            return end, json_loads("".join(parts))
+        return end, json_loads(buf[self.pos:end])
+
+    def _scan(self, eof):
+        # Find the end of the value starting at self.pos. Progress is
+        # kept between calls so a large value split over many chunks
+        # is only scanned once.
+        buf = self.buf
+        if self.vstart != self.pos:
+            self.vstart = self.pos
+            self.vpos = self.pos
+            self.vdepth = 0
+            self.vstr = False
+            c = buf[self.pos]
+            if c == '"':
+                self.vstr = True
+                self.vpos += 1
+            elif c not in "[{":
+                m = _SCALAR_END_RE.search(buf, self.pos)
+                if m is not None:
+                    return self._scanned(m.start())
+                # Scalars are short so just rescan them next time
+                self.vstart = None
+                if eof:
+                    return len(buf)
+                return None
+        pos = self.vpos
+        while True:
+            if self.vstr:
+                m = _STRING_RE.search(buf, pos)
+                if m is None:
+                    self.vpos = len(buf)
+                    return None
+                if m.group() == "\\":
+                    if m.end() >= len(buf):
+                        self.vpos = m.start()
+                        return None
+                    pos = m.end() + 1
+                    continue
+                self.vstr = False
+                pos = m.end()
+                if self.vdepth == 0:
+                    return self._scanned(pos)
+                continue
+            m = _STRUCT_RE.search(buf, pos)
+            if m is None:
+                self.vpos = len(buf)
+                return None
+            c = m.group()
+            pos = m.end()
+            if c == '"':
+                self.vstr = True
+            elif c in "[{":
+                self.vdepth += 1
+            else:
+                self.vdepth -= 1
+                if self.vdepth == 0:
+                    return self._scanned(pos)
+
+    def _scanned(self, end):
+        self.vstart = None
+        return end
+
+
+def iter_json_events(chunks, stream_keys=(), multi=False, item_keys=()):
+    return JSONStreamParser(stream_keys, multi, item_keys).parse(chunks)
+
+
+def _iter_chunks(resp, feed=False):
+    # urllib3 versions with read_chunked hand back each transfer chunk
+    # as it arrives. Older ones, like the one vendored by requests
+    # 1.2.3, block until the read size is filled so open ended feeds
+    # fall back to the small reads iter_lines used to make.
+    size = CHUNK_SIZE
+    if feed and not hasattr(resp.raw, "read_chunked"):
+        size = FEED_CHUNK_SIZE
+    return resp.iter_content(size)
+
+
+def _close_response(resp):
+    # Response.close() in requests 1.2.3 only hands the connection back
+    # to the pool which, part way through a body, leaves the unread
+    # rest in front of the next response on it. Drop the socket first.
+    conn = getattr(resp.raw, "_connection", None)
+    if conn is not None:
+        conn.close()
+    resp.close()
+
+
+class Row(object):
+    __slots__ = ("id", "key", "value", "doc", "error")
+
+    def __init__(self, id=None, key=None, value=None, doc=None, error=None):
+        self.id = id
+        self.key = key
+        self.value = value
+        self.doc = doc
+        self.error = error
+
+    @classmethod
+    def from_dict(cls, row):
+        return cls(row.get("id"), row.get("key"), row.get("value"),
+                row.get("doc"), row.get("error"))
+
+    def __getitem__(self, name):
+        if name not in self.__slots__:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        if name not in self.__slots__:
+            return default
+        return getattr(self, name)
+
+    def keys(self):
+        # Like the row dict it came from: key and value are always there,
+        # the rest only when the server sent them.
+        return [n for n in self.__slots__
+                if n in ("key", "value") or getattr(self, n) is not None]
+
+    def items(self):
+        return [(n, getattr(self, n)) for n in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, name):
+        return name in self.keys()
+
+    def __eq__(self, other):
+        if not isinstance(other, Row):
+            return NotImplemented
+        return all(self[n] == other[n] for n in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        args = (self.id, self.key, self.value)
+        return "<Row id=%r key=%r value=%r>" % args
+
+
+class _Column(object):
+    # Starts as an int64 array, widens to doubles on the first float
+    # and gives up on typing for anything that is not a number.
+    def __init__(self):
+        self.data = array.array("l")
+
+    def append(self, v):
+        data = self.data
+        if isinstance(data, array.array):
+            t = type(v)
+            try:
+                if t is float and data.typecode == "l":
+                    data = self.data = array.array("d", data)
+                if t in (int, long, float):
+                    data.append(v)
+                    return
+            except OverflowError:
+                pass
+            data = self.data = list(data)
+        data.append(v)
+
+
+class _ColumnSet(object):
+    # One column for scalars, one column per element for lists of a
+    # fixed length and a plain list once values stop being uniform.
+    def __init__(self):
+        self.width = None
+        self.cols = None
+        self.values = None
+
+    def append(self, v):
+        if self.values is not None:
+            self.values.append(v)
+            return
+        width = len(v) if isinstance(v, list) and v else -1
+        if self.cols is None:
+            self.width = width
+            self.cols = [_Column() for i in range(max(width, 1))]
+        if width != self.width:
+            self.values = self._values()
+            self.values.append(v)
+            return
+        if width < 0:
+            self.cols[0].append(v)
+            return
+        for col, item in zip(self.cols, v):
+            col.append(item)
+
+    def _values(self):
+        if self.cols is None:
+            return []
+        if self.width < 0:
+            return list(self.cols[0].data)
+        return [list(v) for v in zip(*[c.data for c in self.cols])]
+
+    def result(self):
+        if self.values is not None:
+            return self.values
+        if self.cols is None:
+            return array.array("l")
+        if self.width < 0:
+            return self.cols[0].data
+        return tuple(c.data for c in self.cols)
+
+
+def _slice_rows(events, start, stop):
+    n = 0
+    for event in events:
+        if event[0] != "item":
+            yield event
+            continue
+        if stop is not None and n >= stop:
+            return
+        if n >= start:
+            yield event
+        n += 1
+
+
+def _key_id(key):
+    return json.dumps(_norm_key(key), sort_keys=True)
+
+
+def _norm_key(key):
+    # Keys collate by value so 2.0 and 2 are the same key and the server
+    # is free to echo either form back. Compare integral floats as ints.
+    if isinstance(key, float) and key.is_integer():
+        return int(key)
+    if isinstance(key, list):
+        return [_norm_key(k) for k in key]
+    if isinstance(key, dict):
+        return dict((k, _norm_key(v)) for k, v in key.items())
+    return key
+
+
+def _group_rows(keys, rows):
+    # Rows for a keys request arrive grouped in key order. Anything
+    # that doesn't match a key stays with the preceding group.
+    index = dict((_key_id(k), i) for i, k in enumerate(keys))
+    groups = [[] for k in keys]
+    pos = 0
+    for row in rows:
+        i = index.get(_key_id(row.get("key")))
+        if i is not None and i >= pos:
+            pos = i
+        groups[pos].append(row)
+    return groups
+
+
+def _until_end(events):
+    for kind, key, value in events:
+        if kind == "end":
+            return
+        yield kind, key, value
+
+
 class ViewResult(object):
-    def __init__(self, db, resp):
+    def __init__(self, db, resp, events=None):
         self.db = db
         self.resp = resp
-        result = self.resp.json()
-        self.total_rows = result.get("total_rows")
-        self.offset = result.get("offset")
-        self.rows = result["rows"]
+        if events is None:
+            events = iter_json_events(_iter_chunks(resp), ("rows",))
+        self._events = events
+        self._fields = {}
+        self._pending = collections.deque()
+        self._rows = None
+        self._compact = None
+        self._done = False
+        self._streamed = False
+
+    def close(self):
+        if self.resp is not None:
+            _close_response(self.resp)
+
+    @property
+    def total_rows(self):
+        return self._field("total_rows")
+
+    @property
+    def offset(self):
+        return self._field("offset")
+
+    @property
+    def update_seq(self):
+        return self._field("update_seq")
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = list(self._stream())
+        return self._rows
+
+    @property
+    def compact_rows(self):
+        if self._compact is None:
+            self._compact = [Row.from_dict(r) for r in self]
+        return self._compact
 
     def __iter__(self):
-        return iter(self.rows)
+        if self._rows is not None:
+            return iter(self._rows)
+        if self._compact is not None:
+            return iter(self._compact)
+        return self._stream()
+
+    def to_columns(self):
+        # Rows are folded into columns as they stream so no per-row
+        # dicts are kept. Numeric keys and values become typed arrays,
+        # as do fixed length lists of numbers (one array per element).
+        cols = {}
+        for row in self:
+            if not cols:
+                for name in ("id", "doc"):
+                    if name in row:
+                        cols[name] = []
+                cols["key"] = _ColumnSet()
+                cols["value"] = _ColumnSet()
+            for name, col in cols.items():
+                col.append(row.get(name))
+        if not cols:
+            cols = {"key": _ColumnSet(), "value": _ColumnSet()}
+        for name in ("key", "value"):
+            cols[name] = cols[name].result()
+        return cols
+
+    def to_numpy(self):
+        import numpy
+        def convert(col):
+            if isinstance(col, tuple):
+                return tuple(convert(c) for c in col)
+            if isinstance(col, array.array):
+                return numpy.frombuffer(col, dtype=col.typecode)
+            return numpy.array(col, dtype=object)
+        return dict((k, convert(v)) for k, v in self.to_columns().items())
+
+    def _stream(self):
+        if self._streamed:
+            raise RuntimeError("Error reading from exhausted view result.")
+        self._streamed = True
+        while True:
+            while self._pending:
+                yield self._pending.popleft()
+            if self._done:
+                return
+            self._advance()
+
+    def _buffer(self):
+        self._events = iter(list(self._events))
+
+    def _field(self, name):
+        # Rows read while looking for a field are held for iteration
+        while name not in self._fields and not self._done:
+            self._advance()
+        return self._fields.get(name)
+
+    def _advance(self):
+        try:
+            kind, key, value = next(self._events)
+        except StopIteration:
+            self._done = True
+            if "error" in self._fields:
+                args = (self._fields["error"], self._fields.get("reason"))
+                raise RuntimeError("Error in view result: %s: %s" % args)
+            return
+        if kind == "item":
+            self._pending.append(value)
+        else:
+            self._fields[key] = value
+
+
+class ViewCache(object):
+    """\
+    LRU cache of raw view responses keyed on path, params and body.
+    Entries are revalidated with If-None-Match so a 304 can be served
+    from memory. Total size is bounded by `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=64 << 20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = Counters()
+
+    def key(self, path, params, data):
+        return (path, tuple(sorted(params.items())), data)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.stats.incr("misses")
+                return None
+            self.entries[key] = entry
+            self.stats.incr("revalidations")
+            return entry
+
+    def put(self, key, etag, body):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old[1])
+            while self.entries and self.nbytes + len(body) > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= len(evicted[1])
+                self.stats.incr("evictions")
+            self.entries[key] = (etag, body)
+            self.nbytes += len(body)
+            self.stats.incr("stores")
+
+    def tee(self, key, etag, chunks):
+        # Keep a copy of the body while it streams past and store it
+        # once complete unless it grew too big to be worth keeping.
+        saved = []
+        size = 0
+        for chunk in chunks:
+            if saved is not None:
+                size += len(chunk)
+                if size > self.max_bytes:
+                    saved = None
+                else:
+                    saved.append(chunk)
+            yield chunk
+        if saved is not None:
+            self.put(key, etag, "".join(saved))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+class ViewScanner(object):
+    """\
+    Page through a view with startkey/startkey_docid instead of skip
+    so every request costs the same no matter how deep into the index
+    it starts. `cursor` always points at the next row to be returned
+    and can be passed back in to resume a scan.
+    """
+
+    def __init__(self, db, path, page_size=1000, prefetch=False,
+            cursor=None, **kwargs):
+        for arg in ("keys", "skip", "limit"):
+            if arg in kwargs:
+                raise ValueError("'%s' is not supported by scans" % arg)
+        self.db = db
+        self.path = path
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.kwargs = kwargs
+        self.cursor = cursor
+        self.done = False
+        self.pages = 0
+
+    def __iter__(self):
+        executor = None
+        if self.prefetch:
+            executor = futures.ThreadPoolExecutor(max_workers=1)
+            fetch = self.db.srv.res.bind(self._fetch)
+        try:
+            rows, cursor = self._fetch(self.cursor)
+            while True:
+                upcoming = None
+                if cursor is not None and executor is not None:
+                    upcoming = executor.submit(fetch, cursor)
+                for i, row in enumerate(rows):
+                    if i + 1 < len(rows):
+                        self.cursor = self._position(rows[i + 1])
+                    else:
+                        self.cursor = cursor
+                    yield row
+                if cursor is None:
+                    self.done = True
+                    return
+                if upcoming is not None:
+                    rows, cursor = upcoming.result()
+                else:
+                    rows, cursor = self._fetch(cursor)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def _fetch(self, cursor):
+        kwargs = self.kwargs.copy()
+        if cursor is not None:
+            for k in ("startkey", "start_key", "startkey_docid",
+                    "start_key_doc_id"):
+                kwargs.pop(k, None)
+            kwargs.update(cursor)
+        # One extra row tells us where the next page starts
+        kwargs["limit"] = self.page_size + 1
+        rows = self.db._exec_view(self.path, **kwargs).rows
+        self.pages += 1
+        if len(rows) <= self.page_size:
+            return rows, None
+        return rows[:self.page_size], self._position(rows[self.page_size])
+
+    def _position(self, row):
+        # Map rows can repeat a key so the doc id is needed to say
+        # exactly where in a run of equal keys to pick up.
+        if "id" in row:
+            return {"startkey": row["key"], "startkey_docid": row["id"]}
+        return {"startkey": row["key"]}
 
 
 class Changes(object):
     def __init__(self, db, resp, is_continuous):
         self.db = db
         self.resp = resp
+        self.is_continuous = is_continuous
         if is_continuous:
             self._gen = self._continuous
         else:
@@ -569,10 +3303,14 @@ class Changes(object):
         self._results = None
         self._last_seq = None
 
+    def close(self):
+        _close_response(self.resp)
+
     def __iter__(self):
         self._running = True
         try:
-            for change in self._gen(self.resp.iter_lines()):
+            chunks = _iter_chunks(self.resp, feed=self.is_continuous)
+            for change in self._gen(chunks):
                 yield change
         finally:
             self._running = False
@@ -607,95 +3345,1000 @@ class Changes(object):
         for change in i:
             raise ValueError("Invalid change after last_seq: %r" % change)
 
-    def _continuous(self, line_iter):
-        for line in line_iter:
-            if not line.strip():
-                continue
-            yield json.loads(line)
+    def _continuous(self, chunks):
+        # Heartbeats are bare newlines which the parser skips
+        for _, _, change in iter_json_events(chunks, multi=True):
+            yield change
 
-    def _non_continuous(self, line_iter):
-        state = "init"
-        for line in line_iter:
-            if not line.strip():
-                continue
-            if line.strip() == '{"results":[':
-                state = "starting"
-                break
+    def _non_continuous(self, chunks):
+        tail = {}
+        for kind, key, value in iter_json_events(chunks, ("results",)):
+            if kind == "item":
+                yield value
             else:
-                raise ValueError("Invalid changes line: %r" % line)
-        if state != "starting":
-            raise RuntimeError("Invalid changes feed state. Expected starting")
-        for line in line_iter:
-            if not line.strip():
-                continue
-            if line.strip() == "],":
-                state = "last_seq"
-                break
+                tail[key] = value
+        if "last_seq" not in tail:
+            raise ValueError("Invalid changes feed data: %r" % tail)
+        yield tail
+
+
+class FileCheckpoint(object):
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as handle:
+                return json_loads(handle.read())["seq"]
+        except (IOError, OSError):
+            return None
+
+    def save(self, seq):
+        # Write aside and rename so a crash never leaves half a file
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as handle:
+            handle.write(json_dumps({"seq": seq, "time": time.time()}))
+        os.rename(tmp, self.path)
+
+
+class LocalDocCheckpoint(object):
+    def __init__(self, db, name):
+        self.db = db
+        self.path = db.path("_local", quote(name))
+        self.rev = None
+
+    def load(self):
+        r = self.db.srv.res.get(self.path, raise_errors=False)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        doc = json_loads(r.content)
+        self.rev = doc.get("_rev")
+        return doc.get("seq")
+
+    def save(self, seq):
+        doc = {"seq": seq, "time": time.time()}
+        if self.rev is not None:
+            doc["_rev"] = self.rev
+        r = self.db.srv.res.put(self.path, data=json_dumps(doc),
+                raise_errors=False)
+        if r.status_code == 409:
+            self.load()
+            return self.save(seq)
+        r.raise_for_status()
+        self.rev = json_loads(r.content)["rev"]
+
+
+class ChangesFollower(object):
+    """\
+    Follow a continuous changes feed across dropped connections, stalls
+    and server errors, reconnecting with backoff from the last sequence
+    the consumer finished with. That sequence is saved to `checkpoint`
+    (a FileCheckpoint or LocalDocCheckpoint) every `checkpoint_interval`
+    seconds and when iteration ends.
+
+    A change counts as processed once the consumer asks for the next
+    one so a crash replays at most the changes since the checkpoint.
+    """
+
+    # Older requests (the pinned 1.2.3) let a broken chunked body
+    # surface as the raw httplib or socket error instead
+    ERRORS = RetryPolicy.ERRORS + (httplib.HTTPException, socket.error)
+    if hasattr(requests.exceptions, "ChunkedEncodingError"):
+        ERRORS += (requests.exceptions.ChunkedEncodingError,)
+
+    def __init__(self, db, since=None, checkpoint=None,
+            checkpoint_interval=5.0, heartbeat=10000, stall_timeout=None,
+            retry=None, max_retries=None, path=None, **kwargs):
+        self.db = db
+        self.path = path or db.path("_changes")
+        self.store = checkpoint
+        self.seq = since
+        if checkpoint is not None:
+            saved = checkpoint.load()
+            if saved is not None:
+                self.seq = saved
+        self.saved_seq = self.seq
+        self.checkpoint_interval = checkpoint_interval
+        self.heartbeat = heartbeat
+        if stall_timeout is None:
+            stall_timeout = 2.0 * heartbeat / 1000.0
+        self.stall_timeout = stall_timeout
+        if retry is None:
+            retry = RetryPolicy(backoff=0.5, max_backoff=30.0)
+        self.retry = retry
+        self.max_retries = max_retries
+        self.kwargs = kwargs
+        self.stats = Counters()
+        self.rate = None
+        self.started = None
+        self.last_change = None
+        self.last_data = None
+        self.last_checkpoint = time.time()
+        self._mark = (self.last_checkpoint, 0)
+        self._resp = None
+        self._stopped = False
+
+    def __iter__(self):
+        self.started = time.time()
+        attempt = 0
+        try:
+            while not self._stopped:
+                resp = None
+                try:
+                    resp = self._connect()
+                    attempt = 0
+                    for change in self._read(resp):
+                        yield change
+                        self._advance(change)
+                        if self._stopped:
+                            return
+                    continue
+                except requests.HTTPError as e:
+                    resp = e.response
+                    if resp is None or self._give_up(attempt) or \
+                            resp.status_code not in self.retry.statuses:
+                        raise
+                except self.ERRORS:
+                    if self._stopped:
+                        return
+                    if time.time() - self.last_data >= self.stall_timeout:
+                        self.stats.incr("stalls")
+                    if self._give_up(attempt):
+                        raise
+                    resp = None
+                except Exception:
+                    # Closing the response from stop() breaks the read
+                    if self._stopped:
+                        return
+                    raise
+                finally:
+                    self._resp = None
+                self.stats.incr("reconnects")
+                time.sleep(self.retry.delay(attempt, resp))
+                attempt += 1
+        finally:
+            self.checkpoint()
+
+    def _give_up(self, attempt):
+        self.stats.incr("errors")
+        return self.max_retries is not None and attempt >= self.max_retries
+
+    def stop(self):
+        self._stopped = True
+        resp = self._resp
+        if resp is not None:
+            _close_response(resp)
+
+    def checkpoint(self):
+        self.last_checkpoint = time.time()
+        if self.store is None or self.seq == self.saved_seq:
+            return
+        self.store.save(self.seq)
+        self.saved_seq = self.seq
+        self.stats.incr("checkpoints")
+
+    def lag(self):
+        # Roughly how many updates the follower is behind the database
+        update_seq = self.db.info()["update_seq"]
+        try:
+            return _seq_number(update_seq) - _seq_number(self.seq)
+        except ValueError:
+            return None
+
+    def metrics(self):
+        now = time.time()
+        ret = self.stats.snapshot()
+        ret.update({
+            "seq": self.seq,
+            "checkpoint_seq": self.saved_seq,
+            "rate": self.rate,
+            "idle": None if self.last_change is None
+                    else now - self.last_change,
+            "uptime": None if self.started is None else now - self.started
+        })
+        return ret
+
+    def _connect(self):
+        params = dict(self.kwargs, feed="continuous", heartbeat=self.heartbeat)
+        if self.seq is not None:
+            params["since"] = self.seq
+        self.last_data = time.time()
+        r = self.db.srv.res.get(self.path,
+                params=self.db._params(params), stream=True,
+                timeout=self.stall_timeout, raise_errors=True)
+        self._resp = r
+        if self._stopped:
+            _close_response(r)
+        return r
+
+    def _read(self, resp):
+        # The feed only ends on its own when a timeout or limit was
+        # passed. Resume after last_seq rather than reprocessing.
+        for _, _, change in iter_json_events(self._watch(resp), multi=True):
+            if "last_seq" in change:
+                self.seq = change["last_seq"]
+                return
+            yield change
+
+    def _watch(self, resp):
+        # Heartbeats are data too so a stall is a read timeout
+        for chunk in _iter_chunks(resp, feed=True):
+            self.last_data = time.time()
+            yield chunk
+
+    def _advance(self, change):
+        now = time.time()
+        self.seq = change["seq"]
+        self.last_change = now
+        self.stats.incr("changes")
+        marked, count = self._mark
+        if now - marked >= 1.0:
+            total = self.stats.get("changes")
+            rate = (total - count) / (now - marked)
+            if self.rate is None:
+                self.rate = rate
             else:
-                yield json.loads(line.rstrip().rstrip(","))
-        if state != "last_seq":
-            raise RuntimeError("Invalid changes feed state. Expected last_seq")
-        for line in line_iter:
-            if not line.strip():
-                continue
-            if line.startswith('"last_seq"'):
-                yield json.loads('{' + line)
-                state = "finishing"
-                break
+                self.rate = 0.3 * rate + 0.7 * self.rate
+            self._mark = (now, total)
+        if now - self.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+
+class ChangesProcessor(object):
+    """\
+    Run `func(change)` for changes from any feed on an executor, up to
+    `window` changes outstanding at a time. Changes to the same doc id
+    run one after another in feed order. `seq` only moves past a change
+    once it and every change before it have completed, so checkpoints
+    keep at-least-once delivery. A ProcessPoolExecutor works as long as
+    `func` can be pickled.
+    """
+
+    def __init__(self, func, concurrency=8, window=1000, checkpoint=None,
+            checkpoint_interval=5.0, executor=None):
+        self.func = func
+        self.window = window
+        self.store = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.own_executor = executor is None
+        if executor is None:
+            executor = futures.ThreadPoolExecutor(max_workers=concurrency)
+        self.executor = executor
+        self.cond = threading.Condition()
+        self.stats = Counters()
+        self.seq = None
+        self.saved_seq = None
+        self.error = None
+        self._order = collections.deque()
+        self._docs = {}
+        self._inflight = 0
+        self._source = None
+        self._stopped = False
+
+    def run(self, changes):
+        self._source = changes
+        last = time.time()
+        try:
+            for change in changes:
+                if not self._accept(change):
+                    break
+                if time.time() - last >= self.checkpoint_interval:
+                    self.checkpoint()
+                    last = time.time()
+            with self.cond:
+                while self._inflight:
+                    self.cond.wait(1.0)
+        finally:
+            self._source = None
+            if self.own_executor:
+                self.executor.shutdown(wait=False)
+        self.checkpoint()
+        if self.error is not None:
+            raise self.error
+        return self.seq
+
+    def stop(self):
+        self._stopped = True
+        stop = getattr(self._source, "stop", None)
+        if stop is not None:
+            stop()
+
+    def checkpoint(self):
+        with self.cond:
+            seq = self.seq
+        if self.store is None or seq is None or seq == self.saved_seq:
+            return
+        self.store.save(seq)
+        self.saved_seq = seq
+        self.stats.incr("checkpoints")
+
+    def metrics(self):
+        ret = self.stats.snapshot()
+        with self.cond:
+            ret.update({
+                "seq": self.seq,
+                "checkpoint_seq": self.saved_seq,
+                "inflight": self._inflight,
+                "unordered": len(self._order)
+            })
+        return ret
+
+    def _accept(self, change):
+        with self.cond:
+            while self._inflight >= self.window and self.error is None:
+                self.cond.wait(1.0)
+            if self.error is not None or self._stopped:
+                return False
+            entry = [change.get("seq", change.get("last_seq")), False]
+            self._order.append(entry)
+            if "id" not in change:
+                # A trailing last_seq completes once everything before it
+                entry[1] = True
+                self._collect()
+                return True
+            self._inflight += 1
+            waiting = self._docs.get(change["id"])
+            if waiting is not None:
+                waiting.append((change, entry))
+                self.stats.incr("serialized")
+                return True
+            self._docs[change["id"]] = collections.deque()
+        self._submit(change, entry)
+        return True
+
+    def _submit(self, change, entry):
+        future = self.executor.submit(self.func, change)
+        future.add_done_callback(lambda f: self._done(change, entry, f))
+
+    def _done(self, change, entry, future):
+        following = None
+        with self.cond:
+            self._inflight -= 1
+            error = None
+            if future.cancelled():
+                error = futures.CancelledError()
             else:
-                raise ValueError("Invalid list_seq line: %r" % line)
-        if state != "finishing":
-            yield json
-        for line in line_iter:
-            if not line.strip():
+                error = future.exception()
+            if error is not None:
+                if self.error is None:
+                    self.error = error
+                self.stats.incr("errors")
+            else:
+                entry[1] = True
+                self.stats.incr("processed")
+                self._collect()
+            waiting = self._docs[change["id"]]
+            if waiting and self.error is None:
+                following = waiting.popleft()
+            else:
+                # After an error nothing new starts. Changes still
+                # waiting are dropped and left for the next run.
+                self._inflight -= len(waiting)
+                del self._docs[change["id"]]
+            self.cond.notify_all()
+        if following is not None:
+            self._submit(*following)
+
+    def _collect(self):
+        while self._order and self._order[0][1]:
+            self.seq = self._order.popleft()[0]
+
+
+class ShardChanges(object):
+    """\
+    Read a database's changes straight from one copy of each shard on
+    the nodes' private interfaces, all ranges at once, and merge them
+    into a single stream. Each row keeps its shard local seq as
+    "shard_seq" and gets a clustered "seq" composed from every range's
+    position so far. That seq resumes this reader or a regular
+    _changes feed. Composing costs about as much as parsing a row so
+    `seq_interval` limits it to every Nth row, like the option of the
+    same name on _changes.
+
+    Ranges resume on the copy recorded in `since`. Other ranges go to
+    `replica` (a node name or a callable taking the range and its
+    nodes) or else to the node with the fewest ranges so far.
+    """
+
+    def __init__(self, dbname, since=None, shard_map=None, replica=None,
+            seq_interval=None, server_for=None, maxsize=1024, **kwargs):
+        self.dbname = dbname
+        if server_for is None:
+            server_for = lambda node: get_server(node=node)
+        self.server_for = server_for
+        if shard_map is None:
+            shard_map = get_shard_map(dbname)
+        self.shard_map = shard_map
+        self.suffix = "".join(chr(c) for c in shard_map["shard_suffix"])
+        self.seq_interval = seq_interval
+        self.maxsize = maxsize
+        self.kwargs = kwargs
+        self.last_seq = None
+        self._servers = {}
+        self.positions = self._plan(since, replica)
+
+    def __iter__(self):
+        funcs = []
+        for rng, (node, seq) in self.positions.items():
+            funcs.append(functools.partial(self._read, rng, node, seq))
+        count = 0
+        for rng, change in _interleave(funcs, self.maxsize):
+            if "last_seq" in change:
+                self.positions[rng][1] = change["last_seq"]
                 continue
-            raise ValueError("Invalid changes feed data: %r" % line)
+            self.positions[rng][1] = change["seq"]
+            change["shard_seq"] = change["seq"]
+            change["range"] = rng
+            count += 1
+            if self.seq_interval is None or count % self.seq_interval == 0:
+                change["seq"] = self.since()
+            else:
+                change["seq"] = None
+            yield change
+        self.last_seq = self.since()
+        yield {"last_seq": self.last_seq}
 
+    def since(self):
+        shards = []
+        for rng, (node, seq) in self.positions.items():
+            shards.append(ShardSeq(node, parse_range(rng), seq, None))
+        return encode_seq(shards)
 
-class ViewIterator(object):
-    def __init__(self, db, resp):
-        self.db = db
-        self.resp = resp
-        self.iter = self.resp.iter_lines()
+    def shard_db(self, rng, node):
+        if node not in self._servers:
+            self._servers[node] = self.server_for(node)
+        dbname = urllib.unquote(self.dbname)
+        name = "shards/%s/%s%s" % (rng, dbname, self.suffix)
+        return self._servers[node].db(quote(name))
 
-        line = self.iter.next().strip()
-        if line.endswith("]}"):
-            header = json.loads(line)
-        else:
-            assert line.rstrip().endswith("["), "Invalid view result: %s" % line
-            header = json.loads(line + "]}")
-        assert "rows" in header, "Invalid view result"
+    def _plan(self, since, replica):
+        previous = {}
+        if isinstance(since, basestring) and "-" in since:
+            for shard in decode_seq(since):
+                previous[shard.range] = shard
+        by_range = self.shard_map["by_range"]
+        load = collections.defaultdict(int)
+        positions = collections.OrderedDict()
+        for rng in sorted(by_range, key=parse_range):
+            nodes = by_range[rng]
+            prev = previous.get(parse_range(rng))
+            if prev is not None and prev.node in nodes:
+                node, seq = prev.node, prev.seq
+            else:
+                # Shard seqs mean nothing on another copy so a moved
+                # range starts over rather than skipping changes
+                node, seq = self._pick(rng, nodes, load, replica), 0
+            load[node] += 1
+            positions[rng] = [node, seq]
+        if since == "now":
+            def update_seq(item):
+                rng, (node, _) = item
+                return self.shard_db(rng, node).info()["update_seq"]
+            seqs = _imap_ordered(update_seq, positions.items(), 8)
+            for pos, seq in zip(positions.values(), seqs):
+                pos[1] = seq
+        return positions
 
-        self.total_rows = header.get("total_rows")
-        self.offset = header.get("offset")
-        self._rows = None
+    def _pick(self, rng, nodes, load, replica):
+        if callable(replica):
+            return replica(rng, nodes)
+        if replica in nodes:
+            return replica
+        return min(nodes, key=lambda n: (load[n], n))
 
-    @property
-    def rows(self):
-        self._read()
-        return self._rows
+    def _read(self, rng, node, seq):
+        for change in self.shard_db(rng, node).changes(since=seq,
+                **self.kwargs):
+            yield rng, change
+
+
+class ChangesMultiplexer(object):
+    """\
+    Follow changes on many databases through one _db_updates feed.
+    Only databases reported as created, updated or deleted are read,
+    using plain _changes requests from a pool of `concurrency` threads,
+    so connections do not grow with the number of databases. Iterating
+    yields (dbname, change) pairs.
+
+    `dbnames` is a collection of names or a predicate. Databases with
+    no saved position are read from `db_since`. Positions for every
+    database and the _db_updates seq are saved together to `checkpoint`.
+    A database's position moves once the consumer has taken its rows,
+    and the _db_updates seq never passes an update still being read.
+
+    A database whose reads fail is retried on its own with backoff from
+    `retry`. Its error only ends the iteration once the policy's
+    `max_retries` are used up.
+    """
+
+    def __init__(self, srv, dbnames=None, since=None, db_since=0,
+            checkpoint=None, checkpoint_interval=5.0, concurrency=8,
+            batch_size=1000, heartbeat=10000, maxsize=1024, retry=None,
+            **kwargs):
+        self.srv = srv
+        if dbnames is None or callable(dbnames):
+            self.match = dbnames
+        else:
+            self.match = set(dbnames).__contains__
+        self.db_since = db_since
+        self.store = checkpoint
+        state = {}
+        if checkpoint is not None:
+            state = checkpoint.load() or {}
+        self.positions = dict(state.get("dbs", {}))
+        self.updates_seq = state.get("db_updates", since)
+        self.saved = None
+        self.checkpoint_interval = checkpoint_interval
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.heartbeat = heartbeat
+        if retry is None:
+            retry = RetryPolicy(backoff=0.5, max_backoff=30.0)
+        self.retry = retry
+        self.kwargs = kwargs
+        self.stats = Counters()
+        self.lock = threading.Lock()
+        self.queue = Queue.Queue(maxsize)
+        self.follower = None
+        self.executor = None
+        self._stop = threading.Event()
+        self._running = set()
+        self._again = set()
+        self._gens = {}
+        self._pending = collections.OrderedDict()
+        self._fetched = {}
 
     def __iter__(self):
-        for line in self.iter:
-            if line.strip() == "]}":
+        self._start()
+        last = time.time()
+        try:
+            while not self._stop.is_set():
+                try:
+                    kind, dbname, value = self.queue.get(timeout=1.0)
+                except Queue.Empty:
+                    kind = None
+                if kind == "change":
+                    self.stats.incr("changes")
+                    yield dbname, value
+                elif kind == "error":
+                    raise value
+                elif kind is not None:
+                    self._mark(kind, dbname, value)
+                if time.time() - last >= self.checkpoint_interval:
+                    self.checkpoint()
+                    last = time.time()
+        finally:
+            self.stop()
+            self.checkpoint()
+
+    def stop(self):
+        self._stop.set()
+        if self.follower is not None:
+            self.follower.stop()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def checkpoint(self):
+        if self.store is None:
+            return
+        with self.lock:
+            seq = self.updates_seq
+            if self._pending:
+                seq = next(iter(self._pending.values()))
+            state = {"db_updates": seq, "dbs": dict(self.positions)}
+        if state == self.saved:
+            return
+        self.store.save(state)
+        self.saved = state
+        self.stats.incr("checkpoints")
+
+    def metrics(self):
+        ret = self.stats.snapshot()
+        with self.lock:
+            ret.update({
+                "databases": len(self.positions),
+                "reading": len(self._running),
+                "pending": len(self._pending),
+                "queued": self.queue.qsize()
+            })
+        return ret
+
+    def _start(self):
+        self.executor = futures.ThreadPoolExecutor(
+                max_workers=self.concurrency)
+        self.follower = ChangesFollower(self.srv.db("_db_updates"),
+                path="_db_updates", since=self.updates_seq,
+                heartbeat=self.heartbeat)
+        watcher = threading.Thread(target=self._watch)
+        watcher.daemon = True
+        watcher.start()
+
+    def _watch(self):
+        try:
+            prev = self.updates_seq
+            for row in self.follower:
+                dbname = row.get("dbname")
+                if self.match is None or self.match(dbname):
+                    self._dirty(dbname, prev)
+                prev = row["seq"]
+                with self.lock:
+                    if not self._pending:
+                        self.updates_seq = prev
+        except Exception as e:
+            self._put(("error", None, e))
+
+    def _dirty(self, dbname, prev):
+        # Updates that land while a database is being read just ask
+        # for one more read once the current one finishes.
+        self.stats.incr("db_updates")
+        with self.lock:
+            self._gens[dbname] = self._gens.get(dbname, 0) + 1
+            if dbname not in self._pending:
+                self._pending[dbname] = prev
+            if dbname in self._running:
+                self._again.add(dbname)
                 return
-            yield json.loads(line.rstrip(","))
+            self._running.add(dbname)
+        self.executor.submit(self._fetch, dbname)
 
-    def _read(self):
-        if self._rows == None:
-            self._rows = []
-            for row in self:
-                self._rows.append(row)
+    def _fetch(self, dbname):
+        # The database stays running and pending while it backs off so
+        # the checkpoint can't pass it. Reads pick up where they left
+        # off.
+        attempt = 0
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._read(dbname)
+                except ChangesFollower.ERRORS + (requests.HTTPError,) as e:
+                    resp = getattr(e, "response", None)
+                    if isinstance(e, requests.HTTPError) and (resp is None
+                            or resp.status_code not in self.retry.statuses):
+                        raise
+                    if attempt >= self.retry.max_retries:
+                        raise
+                    self.stats.incr("retries")
+                    self._stop.wait(self.retry.delay(attempt, resp))
+                    attempt += 1
+                    continue
+                attempt = 0
+                with self.lock:
+                    if dbname in self._again:
+                        self._again.discard(dbname)
+                        continue
+                    self._running.discard(dbname)
+                    gen = self._gens.get(dbname)
+                self._put(("done", dbname, gen))
+                return
+        except Exception as e:
+            self._put(("error", dbname, e))
+
+    def _read(self, dbname):
+        db = self.srv.db(quote(dbname))
+        with self.lock:
+            since = self.positions.get(dbname, self.db_since)
+            since = self._fetched.get(dbname, since)
+        while not self._stop.is_set():
+            self.stats.incr("reads")
+            try:
+                c = db.changes(since=since, limit=self.batch_size,
+                        **self.kwargs)
+                results = c.results
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 404:
+                    raise
+                with self.lock:
+                    self._fetched.pop(dbname, None)
+                self._put(("drop", dbname, None))
+                return
+            for change in results:
+                self._put(("change", dbname, change))
+            since = c.last_seq
+            with self.lock:
+                self._fetched[dbname] = since
+            self._put(("seq", dbname, since))
+            if len(results) < self.batch_size:
+                return
+
+    def _mark(self, kind, dbname, value):
+        with self.lock:
+            if kind == "seq":
+                self.positions[dbname] = value
+            elif kind == "drop":
+                self.positions.pop(dbname, None)
+            elif kind == "done" and self._gens.get(dbname) == value:
+                self._pending.pop(dbname, None)
+                if not self._pending:
+                    self.updates_seq = self.follower.seq
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+
+
+def get_shard_map(dbname):
+    return random_node().db("dbs").doc_open(dbname)
+
+
+# ViewResult streams as well now
+ViewIterator = ViewResult
+
+
+class AsyncServer(object):
+    def __init__(self, url, auth=None, max_workers=256, executor=None,
+            max_streams=64, **kwargs):
+        self.srv = Server(url, auth=auth, **kwargs)
+        if executor is None:
+            executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.executor = executor
+        # A stream keeps its worker until the response is exhausted or
+        # closed so streams get their own pool and can't starve submit().
+        # That pool caps how many streams can be open at once, past it
+        # stream() raises rather than queue a reader that may never run.
+        self.stream_executor = futures.ThreadPoolExecutor(
+                max_workers=max_streams)
+        self.max_streams = max_streams
+        self._stream_slots = threading.Semaphore(max_streams)
+        self._streams = weakref.WeakSet()
+        self._ctx = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self, wait=True):
+        for stream in list(self._streams):
+            stream.close()
+        self.executor.shutdown(wait=wait)
+        self.stream_executor.shutdown(wait=wait)
+
+    def submit(self, func, *args, **kwargs):
+        return self.executor.submit(self._bind(func), *args, **kwargs)
+
+    def stream(self, func, *args, **kwargs):
+        if not self._stream_slots.acquire(False):
+            msg = "Too many open streams (max_streams=%d)"
+            raise RuntimeError(msg % self.max_streams)
+        try:
+            ret = AsyncStream(self.stream_executor, func, args, kwargs,
+                    bind=self._bind)
+        except:
+            self._stream_slots.release()
+            raise
+        ret.future.add_done_callback(lambda f: self._stream_slots.release())
+        self._streams.add(ret)
+        return ret
+
+    def welcome(self):
+        return self.submit(self.srv.welcome)
+
+    def active_tasks(self):
+        return self.submit(self.srv.active_tasks)
+
+    def all_dbs(self):
+        return self.submit(self.srv.all_dbs)
+
+    def db(self, name):
+        return AsyncDatabase(self, name)
+
+    def global_changes(self, **kwargs):
+        return self.stream(self.srv.global_changes, **kwargs)
+
+    def config_delete(self, section, key, persist=False):
+        return self.submit(self.srv.config_delete, section, key, persist)
+
+    def config_get(self, section=None, key=None):
+        return self.submit(self.srv.config_get, section, key)
+
+    def config_set(self, section, key, value, persist=False):
+        return self.submit(self.srv.config_set, section, key, value, persist)
+
+    @ctx.contextmanager
+    def user_context(self, username, password, owner=None):
+        # Requests are run later on a worker thread so we capture the
+        # credentials here and re-establish them around each call.
+        orig = getattr(self._ctx, "creds", None)
+        self._ctx.creds = (username, password, owner)
+        try:
+            yield
+        finally:
+            self._ctx.creds = orig
+
+    def wait_for_indexers(self, **kwargs):
+        return self.submit(self.srv.wait_for_indexers, **kwargs)
+
+    def _bind(self, func):
+        creds = getattr(self._ctx, "creds", None)
+        if creds is not None:
+            inner = func
+            def func(*args, **kwargs):
+                with self.srv.user_context(*creds):
+                    return inner(*args, **kwargs)
+        return self.srv.res.bind(func)
+
+
+class AsyncDatabase(object):
+    def __init__(self, server, name):
+        self.asrv = server
+        self.db = Database(server.srv, name)
+        self.name = name
+
+    def path(self, *args):
+        return self.db.path(*args)
+
+    def exists(self, **kwargs):
+        return self.asrv.submit(self.db.exists, **kwargs)
+
+    def create(self, **kwargs):
+        return self.asrv.submit(self.db.create, **kwargs)
+
+    def delete(self, **kwargs):
+        return self.asrv.submit(self.db.delete, **kwargs)
+
+    def reset(self, **kwargs):
+        return self.asrv.submit(self.db.reset, **kwargs)
+
+    def info(self, **kwargs):
+        return self.asrv.submit(self.db.info, **kwargs)
+
+    def doc_delete(self, doc_or_docid, **kwargs):
+        return self.asrv.submit(self.db.doc_delete, doc_or_docid, **kwargs)
+
+    def doc_exists(self, docid, **kwargs):
+        return self.asrv.submit(self.db.doc_exists, docid, **kwargs)
+
+    def doc_open(self, docid, **kwargs):
+        return self.asrv.submit(self.db.doc_open, docid, **kwargs)
+
+    def doc_save(self, doc, **kwargs):
+        return self.asrv.submit(self.db.doc_save, doc, **kwargs)
+
+    def bulk_docs(self, docs, **kwargs):
+        return self.asrv.submit(self.db.bulk_docs, docs, **kwargs)
+
+    def attachment_put(self, docid, name, data, **kwargs):
+        return self.asrv.submit(self.db.attachment_put, docid, name, data,
+                **kwargs)
+
+    def all_docs(self, **kwargs):
+        return self.asrv.stream(self.db.all_docs, **kwargs)
+
+    def view(self, ddoc, vname, **kwargs):
+        return self.asrv.stream(self.db.view, ddoc, vname, **kwargs)
+
+    def changes(self, **kwargs):
+        return self.asrv.stream(self.db.changes, **kwargs)
+
+    def get_security(self):
+        return self.asrv.submit(self.db.get_security)
+
+    def set_security(self, props):
+        return self.asrv.submit(self.db.set_security, props)
+
+    def wait_for_indexers(self, **kwargs):
+        return self.asrv.submit(self.db.wait_for_indexers, **kwargs)
+
+
+class AsyncStream(object):
+    """\
+    Iterate a blocking stream on an executor thread. Items are handed
+    over through a bounded queue so a slow consumer applies backpressure
+    to the reader instead of buffering the whole response. Closing the
+    stream also closes the source if it has a close method, which for
+    ViewResult and Changes releases the underlying response.
+    """
+
+    _DONE = object()
+
+    def __init__(self, executor, func, args=(), kwargs=None, maxsize=1024,
+            bind=None):
+        self.queue = Queue.Queue(maxsize)
+        self._closed = threading.Event()
+        self._source = None
+        # The source is read lazily on the worker so bind the whole run
+        run = self._run if bind is None else bind(self._run)
+        self.future = executor.submit(run, func, args, kwargs or {})
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is self._DONE:
+                break
+            yield item
+        # Re-raise anything the reader hit
+        self.future.result()
+
+    def close(self):
+        self._closed.set()
+        self._close_source()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Queue.Empty:
+                break
+
+    def for_each(self, callback):
+        def _consume():
+            for item in self:
+                callback(item)
+        t = threading.Thread(target=_consume)
+        t.daemon = True
+        t.start()
+        return self.future
+
+    def _run(self, func, args, kwargs):
+        try:
+            self._source = func(*args, **kwargs)
+            if self._closed.is_set():
+                self._close_source()
+            for item in self._source:
+                if not self._put(item):
+                    break
+        except Exception:
+            # Reads fail once close() pulls the response out from under
+            # the reader, nobody is left to see that error.
+            if not self._closed.is_set():
+                raise
+        finally:
+            self._put(self._DONE)
+
+    def _close_source(self):
+        # A running generator can't be closed from another thread, it
+        # stops on its own at the next item instead.
+        source = self._source
+        if source is None or isinstance(source, types.GeneratorType):
+            return
+        close = getattr(source, "close", None)
+        if close is not None:
+            close()
+
+    def _put(self, item):
+        while not self._closed.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
 
 
 def get_server(node=None, interface="private", user="admin", auth=None):
-    if auth is None:
-        auth = CONFIG.get_user(user)
+    url = _server_url(node, interface)
+    return Server(url, auth=_server_auth(user, auth), **_server_opts())
+
+
+def get_async_server(node=None, interface="private", user="admin", auth=None,
+        **kwargs):
+    url = _server_url(node, interface)
+    return AsyncServer(url, auth=_server_auth(user, auth),
+            **_server_opts(kwargs))
+
+
+def _server_url(node, interface):
     if node is None:
-        url = CONFIG.cluster_url
-    else:
-        url = "".join((CONFIG.protocol, "://", CONFIG.nodes[node][interface]))
-    return Server(url, auth=auth)
+        return CONFIG.cluster_url
+    return "".join((CONFIG.protocol, "://", CONFIG.nodes[node][interface]))
+
+
+def _server_auth(user, auth):
+    if auth is None:
+        return CONFIG.get_user(user)
+    return auth
+
+
+def _server_opts(kwargs=None):
+    ret = {}
+    if CONFIG.gzip_threshold is not None:
+        ret["gzip_threshold"] = int(CONFIG.gzip_threshold)
+    ret.update(kwargs or {})
+    return ret
 
 
 def random_node(interface="private", user="admin"):
@@ -710,6 +4353,12 @@ def nodes(interface="private", user="admin"):
     return ret
 
 
+def balanced_server(interface="public", user="admin", auth=None, **lbopts):
+    urls = [_server_url(name, interface) for name in sorted(CONFIG.nodes)]
+    auth = _server_auth(user, auth)
+    return Server(urls[0], auth=auth, balance=urls[1:], **_server_opts(lbopts))
+
+
 # Hamcrest helpers
 
 class HasHeader(BaseMatcher):
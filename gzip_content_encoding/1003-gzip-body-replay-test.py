@@ -0,0 +1,95 @@
+import StringIO
+import zlib
+
+from hamcrest import *
+
+import cloudant
+
+
+DATA = "".join("line %d of some compressible text\n" % i
+        for i in xrange(6000))
+
+
+class Reader(object):
+    # A pipe-like file that can only be read front to back
+    def __init__(self, data):
+        self.f = StringIO.StringIO(data)
+
+    def read(self, size=-1):
+        return self.f.read(size)
+
+
+class Response(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {"Retry-After": "0"}
+        self.content = '{"ok":true,"id":"d","rev":"1-a"}'
+        self.raw = None
+
+    def close(self):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+
+class Session(object):
+    # Fails the first `failures` requests with a 503 and records what
+    # each request body decoded to
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.auth = None
+        self.headers = {}
+        self.bodies = []
+
+    def put(self, url, data=None, headers=None, **kwargs):
+        body = "".join(data) if not isinstance(data, str) else data
+        if (headers or {}).get("Content-Encoding") == "gzip":
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        self.bodies.append(body)
+        if self.failures:
+            self.failures -= 1
+            return Response(503)
+        return Response(201)
+
+
+def server(failures=0):
+    retry = cloudant.RetryPolicy(max_retries=3, backoff=0,
+            breaker_threshold=None)
+    srv = cloudant.Server("http://127.0.0.1:5984", retry=retry,
+            gzip_threshold=1000)
+    srv.res.s = Session(failures)
+    return srv
+
+
+def put(srv, data):
+    return srv.db("db").attachment_put("d", "a.txt", data,
+            content_type="text/plain")
+
+
+def test_unseekable_source_is_sent_whole():
+    srv = server()
+    put(srv, Reader(DATA))
+    assert_that(srv.res.s.bodies, equal_to([DATA]))
+
+
+def test_unseekable_source_is_not_retried():
+    srv = server(failures=1)
+    put(srv, Reader(DATA))
+    assert_that(srv.res.s.bodies, equal_to([DATA]))
+    assert_that(srv.last_status_code(), equal_to(503))
+
+
+def test_seekable_source_restarts_where_it_started():
+    srv = server(failures=2)
+    f = StringIO.StringIO("skipped header" + DATA)
+    f.seek(len("skipped header"))
+    put(srv, f)
+    assert_that(srv.res.s.bodies, equal_to([DATA] * 3))
+    assert_that(srv.last_status_code(), equal_to(201))
+
+
+def test_string_source_is_retried():
+    srv = server(failures=1)
+    put(srv, DATA)
+    assert_that(srv.res.s.bodies, equal_to([DATA] * 2))
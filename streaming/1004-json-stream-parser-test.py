@@ -0,0 +1,189 @@
+import collections
+import json
+import random
+
+from hamcrest import *
+
+import cloudant
+
+
+ROWS = [
+    {"id": "a", "key": ["x", 1], "value": {"rev": "1-abc"}},
+    {"id": "b]}\"", "key": "q\\\"uote", "value": None},
+    {"id": "c", "key": -12.5e3, "value": [1, 2, {"n": 12345678901}]},
+    {"id": "d", "key": u"\u00e9t\u00e9", "value": True}
+]
+
+BODY = collections.OrderedDict([
+    ("total_rows", 4),
+    ("offset", 0),
+    ("rows", ROWS)
+])
+
+EXPECT = [("field", "total_rows", 4), ("field", "offset", 0)] + \
+        [("item", "rows", r) for r in ROWS]
+
+# Codecs without raw_decode go through the scanner for every value
+SCAN_CODEC = cloudant.JSONCodec("scan", json.dumps, json.loads)
+
+
+def couch_layout(body):
+    # How CouchDB itself lays out view responses, one row per line
+    rows = ",\r\n".join(json.dumps(r) for r in body["rows"])
+    return '{"total_rows":%d,"offset":%d,"rows":[\r\n%s\r\n]}\n' % (
+            body["total_rows"], body["offset"], rows)
+
+
+LAYOUTS = [
+    json.dumps(BODY),
+    json.dumps(BODY, separators=(",", ":")),
+    json.dumps(BODY, indent=4),
+    couch_layout(BODY)
+]
+
+
+def parse(chunks, stream_keys=("rows",), multi=False):
+    events = cloudant.iter_json_events(chunks, stream_keys, multi)
+    return [(kind, key, value) for kind, key, value in events]
+
+
+def each_codec(func):
+    orig = cloudant.JSON
+    try:
+        for codec in (cloudant.load_json_codec("json"), SCAN_CODEC):
+            cloudant.JSON = codec
+            func()
+    finally:
+        cloudant.JSON = orig
+
+
+def splits(data):
+    for i in range(len(data) + 1):
+        yield [data[:i], data[i:]]
+
+
+def test_whole_body():
+    def check():
+        for body in LAYOUTS:
+            assert_that(parse([body]), equal_to(EXPECT))
+    each_codec(check)
+
+
+def test_every_split_point():
+    def check():
+        for body in LAYOUTS:
+            for chunks in splits(body):
+                assert_that(parse(chunks), equal_to(EXPECT))
+    each_codec(check)
+
+
+def test_byte_at_a_time():
+    def check():
+        for body in LAYOUTS:
+            assert_that(parse(list(body)), equal_to(EXPECT))
+    each_codec(check)
+
+
+def test_random_chunks():
+    rand = random.Random(42)
+    def check():
+        for body in LAYOUTS:
+            for _ in range(50):
+                chunks = []
+                pos = 0
+                while pos < len(body):
+                    size = rand.randint(1, 16)
+                    chunks.append(body[pos:pos + size])
+                    pos += size
+                assert_that(parse(chunks), equal_to(EXPECT))
+    each_codec(check)
+
+
+def test_numbers_split_across_chunks():
+    body = '{"rows":[12345, -1.5e10,0 ,7]}'
+    expect = [("item", "rows", v) for v in (12345, -1.5e10, 0, 7)]
+    def check():
+        for chunks in splits(body):
+            assert_that(parse(chunks), equal_to(expect))
+    each_codec(check)
+
+
+def test_unstreamed_arrays_are_fields():
+    body = '{"rows": [1, 2], "total_rows": 2}'
+    assert_that(parse([body], stream_keys=()), equal_to([
+        ("field", "rows", [1, 2]),
+        ("field", "total_rows", 2)
+    ]))
+
+
+def test_empty_rows():
+    body = '{"total_rows":0,"offset":0,"rows":[\r\n\r\n]}\n'
+    def check():
+        for chunks in splits(body):
+            assert_that(parse(chunks), equal_to([
+                ("field", "total_rows", 0),
+                ("field", "offset", 0)
+            ]))
+    each_codec(check)
+
+
+def test_continuous_lines():
+    changes = [{"seq": i, "id": "d%d" % i, "changes": []} for i in range(3)]
+    # Heartbeats arrive as bare newlines between changes
+    body = "\n".join(json.dumps(c) for c in changes) + "\n\n\n" + \
+            '{"last_seq":3}\n'
+    expect = [("value", None, c) for c in changes]
+    expect.append(("value", None, {"last_seq": 3}))
+    def check():
+        for chunks in splits(body):
+            assert_that(parse(chunks, (), multi=True), equal_to(expect))
+    each_codec(check)
+
+
+def test_truncated_body():
+    body = couch_layout(BODY)
+    for end in (len(body) / 2, len(body) - 3):
+        assert_that(calling(parse).with_args([body[:end]]),
+                raises(ValueError))
+
+
+def test_trailing_garbage():
+    assert_that(calling(parse).with_args(['{"rows":[]} x']),
+            raises(ValueError))
+
+
+def test_large_value_over_many_chunks():
+    # A document far bigger than a chunk, as with include_docs and big
+    # inline attachments. The parser must not recopy it on every chunk.
+    doc = collections.OrderedDict([
+        ("_id", "big"),
+        ("data", ("x" * 4000 + "\\\"") * 2000),
+        ("list", [{"n": i} for i in range(20000)])
+    ])
+    body = json.dumps({"rows": [{"id": "big", "doc": doc}, 1]})
+    chunks = [body[i:i + 4096] for i in range(0, len(body), 4096)]
+    def check():
+        assert_that(parse(chunks), equal_to([
+            ("item", "rows", {"id": "big", "doc": doc}),
+            ("item", "rows", 1)
+        ]))
+    each_codec(check)
+
+
+def test_nested_item_rows():
+    results = [BODY, collections.OrderedDict([("rows", [])]), 7]
+    body = json.dumps({"results": results})
+    expect = [("begin", "results", None)] + EXPECT + \
+            [("end", "results", None)] + \
+            [("begin", "results", None), ("end", "results", None)] + \
+            [("item", "results", 7)]
+    def check():
+        for chunks in splits(body):
+            events = parse(chunks, ("results",))
+            assert_that(events, equal_to([("item", "results", results[0]),
+                    ("item", "results", {"rows": []}),
+                    ("item", "results", 7)]))
+            events = cloudant.iter_json_events(chunks, ("results",),
+                    item_keys=("rows",))
+            assert_that(list(events), equal_to(expect))
+    each_codec(check)
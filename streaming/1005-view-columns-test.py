@@ -0,0 +1,58 @@
+import array
+import json
+
+from hamcrest import *
+
+import cloudant
+
+
+ROWS = [
+    {"id": "a", "key": 1, "value": [1, 2.5]},
+    {"id": "b", "key": 2, "value": [3, 4]}
+]
+
+
+def result(rows):
+    body = json.dumps({"total_rows": len(rows), "offset": 0, "rows": rows})
+    events = cloudant.iter_json_events([body], ("rows",))
+    return cloudant.ViewResult(None, None, events)
+
+
+def test_row_is_dict_like():
+    row = cloudant.Row.from_dict(ROWS[0])
+    assert_that("id" in row, equal_to(True))
+    assert_that("doc" in row, equal_to(False))
+    assert_that(0 in row, equal_to(False))
+    assert_that(sorted(row.keys()), equal_to(["id", "key", "value"]))
+    assert_that(dict(row.items()), equal_to(ROWS[0]))
+
+
+def test_reduce_row_has_no_id():
+    row = cloudant.Row.from_dict({"key": None, "value": 3})
+    assert_that("id" in row, equal_to(False))
+    assert_that("key" in row, equal_to(True))
+
+
+def test_columns():
+    cols = result(ROWS).to_columns()
+    assert_that(sorted(cols), equal_to(["id", "key", "value"]))
+    assert_that(cols["id"], equal_to(["a", "b"]))
+    assert_that(cols["key"], equal_to(array.array("l", [1, 2])))
+    assert_that(cols["value"], equal_to((
+        array.array("d", [1, 3]),
+        array.array("d", [2.5, 4])
+    )))
+
+
+def test_columns_after_compact_rows():
+    res = result(ROWS)
+    res.compact_rows
+    assert_that(res.to_columns(), equal_to(result(ROWS).to_columns()))
+
+
+def test_columns_of_empty_result():
+    cols = result([]).to_columns()
+    assert_that(cols, equal_to({
+        "key": array.array("l"),
+        "value": array.array("l")
+    }))
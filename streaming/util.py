@@ -44,14 +44,8 @@ def load_data(db):
             }
     num_docs = db.info()["doc_count"]
     assert 1 <= num_docs <= NUM_DOCS
-    batch = []
-    for doc in make_docs(NUM_DOCS - num_docs):
-        batch.append(doc)
-        if len(batch) >= 100:
-            db.bulk_docs(batch)
-            batch = []
-    if len(batch):
-        db.bulk_docs(batch)
+    with db.bulk_writer(batch_size=100) as writer:
+        writer.extend(make_docs(NUM_DOCS - num_docs))
 
 
 def create_streaming_db():
@@ -0,0 +1,127 @@
+import json
+
+from hamcrest import *
+
+import cloudant
+
+
+# (key, id, value) rows of a view as the server has them indexed.
+# Keys emitted as 2.0 come back as 2.0 whichever form was asked for.
+INDEX = [
+    ("a", "a1", 1),
+    ("a", "a2", 2),
+    ("b", "b1", 3),
+    ("c", "c1", 4),
+    ("c", "c2", 5),
+    ("c", "c3", 6),
+    (2.0, "n1", 7),
+    ([1, 2.0], "l1", 8),
+    ("d", "d1", 9)
+]
+
+
+def collate(key):
+    return json.dumps(cloudant._norm_key(key), sort_keys=True)
+
+
+def server_rows(keys):
+    rows = []
+    for k in keys:
+        for key, docid, value in INDEX:
+            if collate(key) == collate(k):
+                rows.append({"id": docid, "key": key, "value": value})
+    return rows
+
+
+class Response(object):
+    def __init__(self, body):
+        self.status_code = 200
+        self.headers = {}
+        self.content = body
+        self.raw = None
+
+    def iter_content(self, size):
+        for i in range(0, len(self.content), size):
+            yield self.content[i:i + size]
+
+    def close(self):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+
+class Session(object):
+    def __init__(self):
+        self.auth = None
+        self.headers = {}
+        self.batches = []
+
+    def post(self, url, data=None, **kwargs):
+        keys = json.loads(data)["keys"]
+        self.batches.append(keys)
+        rows = server_rows(keys)
+        body = {"total_rows": len(INDEX), "offset": 0, "rows": rows}
+        return Response(json.dumps(body))
+
+
+def database(batch_size=3):
+    srv = cloudant.Server("http://127.0.0.1:5984")
+    srv.res.s = Session()
+    db = srv.db("db")
+    db.keys_batch_size = batch_size
+    db.keys_concurrency = 2
+    return db
+
+
+def view(db, keys, **kwargs):
+    return db.view("ddoc", "view", keys=keys, **kwargs).rows
+
+
+def expect(keys):
+    return json.loads(json.dumps(server_rows(keys)))
+
+
+def test_duplicate_keys():
+    db = database()
+    keys = ["c", "a", "c", "b", "a", "d", "c"]
+    assert_that(view(db, keys), equal_to(expect(keys)))
+    # Each distinct key is only asked for once
+    sent = sum(db.srv.res.s.batches, [])
+    assert_that(sorted(sent), equal_to(["a", "b", "c", "d"]))
+
+
+def test_missing_keys():
+    db = database()
+    keys = ["x", "a", "y", "z", "b", "x", "q", "r", "d"]
+    assert_that(view(db, keys), equal_to(expect(keys)))
+
+
+def test_integral_floats():
+    db = database(batch_size=2)
+    keys = [2, "a", 2.0, [1, 2], "b", [1.0, 2.0], 2]
+    rows = view(db, keys)
+    assert_that(rows, equal_to(expect(keys)))
+    assert_that([r["id"] for r in rows], equal_to(
+            ["n1", "a1", "a2", "n1", "l1", "b1", "l1", "n1"]))
+    sent = sum(db.srv.res.s.batches, [])
+    assert_that(len(sent), equal_to(4))
+
+
+def test_skip_and_limit_across_batches():
+    keys = ["a", "x", "c", "b", "a", "d", "c", "y", 2]
+    full = expect(keys)
+    for skip in range(len(full) + 2):
+        for limit in (None, 0, 1, 2, 4, 7, 20):
+            stop = None if limit is None else skip + limit
+            kwargs = {"skip": skip}
+            if limit is not None:
+                kwargs["limit"] = limit
+            rows = view(database(batch_size=2), keys, **kwargs)
+            assert_that(rows, equal_to(full[skip:stop]))
+
+
+def test_fields_come_from_the_first_batch():
+    res = database().view("ddoc", "view", keys=["a", "b", "c", "d"])
+    assert_that(res.total_rows, equal_to(len(INDEX)))
+    assert_that(len(res.rows), equal_to(7))